@@ -4,7 +4,8 @@ from aws_cdk.aws_apigateway import (
     Cors,
     CorsOptions,
     LambdaIntegration,
-    LambdaRestApi,
+    Resource,
+    RestApi,
 )
 from aws_cdk.aws_cloudfront import BehaviorOptions, Distribution, PriceClass, ViewerProtocolPolicy
 from aws_cdk.aws_cloudfront_origins import S3Origin
@@ -19,7 +20,7 @@ from aws_cdk.aws_cognito import (
     UserVerificationConfig,
     VerificationEmailStyle,
 )
-from aws_cdk.aws_dynamodb import Attribute, AttributeType, BillingMode, Table
+from aws_cdk.aws_dynamodb import Attribute, AttributeType, BillingMode, ProjectionType, Table
 from aws_cdk.aws_iam import PolicyStatement
 from aws_cdk.aws_lambda import Runtime
 from aws_cdk.aws_lambda_python import PythonFunction
@@ -38,12 +39,17 @@ class SaveTheSpiceStack(Stack):
         images_bucket_name = f"{prefix}Images"
         cloudfront_name = f"{prefix}Distribution"
         auth_lambda_name = f"{prefix}AuthLambda"
-        main_lambda_name = f"{prefix}Lambda"
+        recipes_lambda_name = f"{prefix}RecipesLambda"
+        share_lambda_name = f"{prefix}ShareLambda"
+        shopping_list_lambda_name = f"{prefix}ShoppingListLambda"
         user_pool_name = f"{prefix}UserPool"
         meta_table_name = f"{prefix}Meta"
         recipes_table_name = f"{prefix}Recipes"
         categories_table_name = f"{prefix}Categories"
         share_table_name = f"{prefix}Shares"
+        image_refs_table_name = f"{prefix}ImageRefs"
+        scrape_cache_table_name = f"{prefix}ScrapeCache"
+        recipe_tombstones_table_name = f"{prefix}RecipeTombstones"
         endpoint_name = f"{prefix}Endpoint"
         authorizer_name = f"{prefix}APIAuthorizer"
 
@@ -133,6 +139,15 @@ class SaveTheSpiceStack(Stack):
             read_capacity=5,
             write_capacity=5,
         )
+        # Find recipes changed since a time, for syncing
+        recipes_table.add_global_secondary_index(
+            index_name="userId-updateTime-index",
+            partition_key=Attribute(name="userId", type=AttributeType.STRING),
+            sort_key=Attribute(name="updateTime", type=AttributeType.STRING),
+            projection_type=ProjectionType.KEYS_ONLY,
+            read_capacity=5,
+            write_capacity=5,
+        )
 
         categories_table = Table(
             self,
@@ -144,6 +159,15 @@ class SaveTheSpiceStack(Stack):
             read_capacity=5,
             write_capacity=5,
         )
+        # Look up categories by name, without reading every category a user has
+        categories_table.add_global_secondary_index(
+            index_name="userId-name-index",
+            partition_key=Attribute(name="userId", type=AttributeType.STRING),
+            sort_key=Attribute(name="name", type=AttributeType.STRING),
+            projection_type=ProjectionType.KEYS_ONLY,
+            read_capacity=5,
+            write_capacity=5,
+        )
 
         share_table = Table(
             self,
@@ -155,18 +179,73 @@ class SaveTheSpiceStack(Stack):
             write_capacity=1,
         )
 
-        auth_lambda = PythonFunction(
+        image_refs_table = Table(
             self,
-            auth_lambda_name.lower(),
-            function_name=auth_lambda_name,
-            entry="src/backend/savethespice",
-            handler="app",
-            runtime=Runtime.PYTHON_3_9,
-            timeout=Duration.minutes(1),
-            environment={
-                "meta_table_name": meta_table_name,
-                "user_pool_id": user_pool.user_pool_id,
-            },
+            image_refs_table_name.lower(),
+            table_name=image_refs_table_name,
+            partition_key=Attribute(name="imageKey", type=AttributeType.STRING),
+            billing_mode=BillingMode.PROVISIONED,
+            read_capacity=1,
+            write_capacity=5,
+        )
+
+        scrape_cache_table = Table(
+            self,
+            scrape_cache_table_name.lower(),
+            table_name=scrape_cache_table_name,
+            partition_key=Attribute(name="url", type=AttributeType.STRING),
+            billing_mode=BillingMode.PROVISIONED,
+            read_capacity=2,
+            write_capacity=1,
+            time_to_live_attribute="ttl",
+        )
+
+        recipe_tombstones_table = Table(
+            self,
+            recipe_tombstones_table_name.lower(),
+            table_name=recipe_tombstones_table_name,
+            partition_key=Attribute(name="userId", type=AttributeType.STRING),
+            sort_key=Attribute(name="recipeId", type=AttributeType.NUMBER),
+            billing_mode=BillingMode.PROVISIONED,
+            read_capacity=1,
+            write_capacity=2,
+            time_to_live_attribute="ttl",
+        )
+
+        # Every function loads the same settings, though each only uses some of them
+        lambda_environment = {
+            "images_bucket_name": images_bucket_name.lower(),
+            "meta_table_name": meta_table_name,
+            "recipes_table_name": recipes_table_name,
+            "categories_table_name": categories_table_name,
+            "share_table_name": share_table_name,
+            "image_refs_table_name": image_refs_table_name,
+            "scrape_cache_table_name": scrape_cache_table_name,
+            "recipe_tombstones_table_name": recipe_tombstones_table_name,
+            "user_pool_id": user_pool.user_pool_id,
+        }
+
+        def create_lambda(name: str, app: str, **kwargs) -> PythonFunction:
+            """
+            Create a function serving one of the apps in `savethespice.apps`, so that it only
+            imports the code for the routes it serves.
+            """
+            return PythonFunction(
+                self,
+                name.lower(),
+                function_name=name,
+                entry="src/backend",
+                index=f"savethespice/apps/{app}.py",
+                handler="handler",
+                runtime=Runtime.PYTHON_3_9,
+                timeout=Duration.minutes(1),
+                environment=lambda_environment,
+                **kwargs,
+            )
+
+        auth_lambda = create_lambda(
+            auth_lambda_name,
+            "auth",
             initial_policy=[
                 PolicyStatement(
                     actions=["cognito-idp:*"],
@@ -174,29 +253,18 @@ class SaveTheSpiceStack(Stack):
                 ),
             ],
         )
-
         meta_table.grant_write_data(auth_lambda)
 
-        main_lambda = PythonFunction(
-            self,
-            main_lambda_name.lower(),
-            function_name=main_lambda_name,
-            entry="src/backend/savethespice",
-            handler="app",
-            runtime=Runtime.PYTHON_3_9,
-            timeout=Duration.minutes(1),
-            environment={
-                "images_bucket_name": images_bucket_name.lower(),
-                "meta_table_name": meta_table_name,
-                "recipes_table_name": recipes_table_name,
-                "categories_table_name": categories_table_name,
-                "share_table_name": share_table_name,
-                "user_pool_id": user_pool.user_pool_id,
-            },
+        recipes_lambda = create_lambda(
+            recipes_lambda_name,
+            "recipes",
+            # Room to decode images for resizing, see `IMAGE_MAX_PIXELS`
+            memory_size=1024,
             initial_policy=[
                 PolicyStatement(
                     actions=[
                         "dynamodb:DeleteItem",
+                        "dynamodb:BatchGetItem",
                         "dynamodb:BatchWriteItem",
                         "dynamodb:GetItem",
                         "dynamodb:PutItem",
@@ -206,21 +274,32 @@ class SaveTheSpiceStack(Stack):
                     resources=[
                         meta_table.table_arn,
                         recipes_table.table_arn,
+                        f"{recipes_table.table_arn}/index/*",
                         categories_table.table_arn,
-                        share_table.table_arn,
+                        f"{categories_table.table_arn}/index/*",
+                        image_refs_table.table_arn,
+                        scrape_cache_table.table_arn,
+                        recipe_tombstones_table.table_arn,
                     ],
                 ),
             ],
         )
+        images_bucket.grant_put(recipes_lambda.grant_principal)
+        images_bucket.grant_delete(recipes_lambda.grant_principal)
+        # Checking whether images stored before references were counted exist
+        images_bucket.grant_read(recipes_lambda.grant_principal)
+
+        share_lambda = create_lambda(share_lambda_name, "share")
+        share_table.grant_read_write_data(share_lambda)
+        recipes_table.grant_read_data(share_lambda)
 
-        images_bucket.grant_put(main_lambda.grant_principal)
-        images_bucket.grant_delete(main_lambda.grant_principal)
+        shopping_list_lambda = create_lambda(shopping_list_lambda_name, "shopping_list")
+        meta_table.grant_read_write_data(shopping_list_lambda)
 
-        root_endpoint = LambdaRestApi(
+        root_endpoint = RestApi(
             self,
             endpoint_name.lower(),
             rest_api_name=endpoint_name,
-            handler=main_lambda,
             default_cors_preflight_options=CorsOptions(
                 allow_origins=Cors.ALL_ORIGINS, max_age=Duration.days(1)
             ),
@@ -236,14 +315,29 @@ class SaveTheSpiceStack(Stack):
             provider_arns=[user_pool.user_pool_arn],
         )
 
-        auth_resource = root_endpoint.root.add_resource("auth")
-        recipes_resource = root_endpoint.root.add_resource("recipes")
-        categories_resource = root_endpoint.root.add_resource("categories")
-        shopping_list_resource = root_endpoint.root.add_resource("shoppinglist")
-        scrape_resource = root_endpoint.root.add_resource("scrape")
-        recipe_resource = recipes_resource.add_resource("{recipe}")
-        category_resource = categories_resource.add_resource("{category}")
-        shopping_list_item_resource = shopping_list_resource.add_resource("{item}")
+        def add_method(resource: Resource, function: PythonFunction, authorize: bool) -> None:
+            method = resource.add_method(
+                "ANY",
+                LambdaIntegration(function),
+                authorization_type=AuthorizationType.COGNITO if authorize else None,
+            )
+            if authorize:
+                method.node.find_child("Resource").add_property_override(
+                    "AuthorizerId", {"Ref": authorizer.logical_id}
+                )
+
+        # Resources mirror the routers' paths, each served by the function for its router
+        public_resource = root_endpoint.root.add_resource("public")
+        private_resource = root_endpoint.root.add_resource("private")
+        auth_resource = public_resource.add_resource("auth")
+        share_resource = public_resource.add_resource("share")
+        share_id_resource = share_resource.add_resource("{share_id}")
+        recipes_resource = private_resource.add_resource("recipes")
+        recipe_resource = recipes_resource.add_resource("{recipe_id}")
+        scrape_resource = private_resource.add_resource("scrape")
+        categories_resource = private_resource.add_resource("categories")
+        category_resource = categories_resource.add_resource("{category_id}")
+        shopping_list_resource = private_resource.add_resource("shoppinglist")
 
         for operation in (
             "signup",
@@ -254,7 +348,11 @@ class SaveTheSpiceStack(Stack):
             "forgotpassword",
             "confirmforgotpassword",
         ):
-            auth_resource.add_resource(operation).add_method("ANY", LambdaIntegration(auth_lambda))
+            add_method(auth_resource.add_resource(operation), auth_lambda, authorize=False)
+
+        # Creating a share link needs the user, getting a shared recipe doesn't
+        add_method(share_resource, share_lambda, authorize=True)
+        add_method(share_id_resource, share_lambda, authorize=False)
 
         # POST: Create, send back identifier
         # PATCH: Update resource's specified fields, exception if identifier not found
@@ -265,17 +363,9 @@ class SaveTheSpiceStack(Stack):
             recipe_resource,
             categories_resource,
             category_resource,
-            shopping_list_resource,
-            shopping_list_item_resource,
         ):
-            resource.add_method(
-                "ANY",
-                LambdaIntegration(main_lambda),
-                authorization_type=AuthorizationType.COGNITO,
-                # authorizer=authorizer.ref,
-            ).node.find_child("Resource").add_property_override(
-                "AuthorizerId", {"Ref": authorizer.logical_id}
-            )
+            add_method(resource, recipes_lambda, authorize=True)
+        add_method(shopping_list_resource, shopping_list_lambda, authorize=True)
 
         user_pool.add_domain(
             f"{user_pool_name}domain".lower(),
@@ -288,4 +378,5 @@ class SaveTheSpiceStack(Stack):
             id_token_validity=Duration.days(1),
             refresh_token_validity=Duration.days(365),
         )
-        auth_lambda.add_environment(key="client_id", value=client.user_pool_client_id)
+        for function in (auth_lambda, recipes_lambda, share_lambda, shopping_list_lambda):
+            function.add_environment(key="client_id", value=client.user_pool_client_id)
@@ -0,0 +1,107 @@
+"""
+Measure what importing each Lambda entry point costs at cold start, per module, and report it
+against the budget in `import_budget.json`, exiting with an error if a dependency that should only
+be imported by the routes or functions using it is loaded.
+
+Import times vary too much between machines to fail on, so modules over their budget are only
+reported. `tests/test_import_time.py` checks the deferred dependencies as part of the tests.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+REPEATS = 5
+BUDGET_PATH = Path(__file__).with_name("import_budget.json")
+BACKEND_PATH = Path(__file__).parents[1]
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Settings are required to import the app's modules, though nothing here touches AWS
+ENV = {
+    "client_id": "benchmark",
+    "user_pool_id": "benchmark",
+    "recipes_table_name": "benchmark",
+    "categories_table_name": "benchmark",
+    "meta_table_name": "benchmark",
+    "images_bucket_name": "benchmark",
+    "UVICORN_PORT": "8000",
+}
+
+
+def measure(entry: str, repeats: int = REPEATS) -> tuple[dict[str, float], set[str]]:
+    """
+    Import a module in a fresh interpreter, keeping the fastest of a few runs to smooth out noise.
+
+    :param entry: Module to import
+    :param repeats: Number of runs
+    :return: (Cumulative import time of each module in ms, Modules that were imported)
+    """
+    code = f"import sys, {entry}; print(*sys.modules, sep='\\n')"
+    times: dict[str, float] = {}
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=BACKEND_PATH,
+            env={**ENV, **os.environ},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for line in proc.stderr.splitlines():
+            if match := IMPORT_TIME_PATTERN.match(line):
+                module, cumulative = match[4], int(match[2]) / 1000
+                times[module] = min(times.get(module, cumulative), cumulative)
+
+    return times, set(proc.stdout.splitlines())
+
+
+def check(entry: str, modules: dict[str, int], deferred: list[str]) -> list[str]:
+    """
+    Check an entry point against its budget, reporting modules over their import time budget.
+
+    :param entry: Module the Lambda function is loaded from
+    :param modules: Budget for the cumulative import time of each module in ms
+    :param deferred: Modules that shouldn't be imported at cold start
+    :return: Failures, for deferred modules that were imported
+    """
+    times, imported = measure(entry)
+
+    failures = [f"{module} is imported by {entry}." for module in deferred if module in imported]
+    print(f"Importing {entry} (ms, fastest of {REPEATS}):")
+    for module, limit in modules.items():
+        cost = times.get(module, 0)
+        print(f"  {module}: {cost:.0f} / {limit}{' (over budget)' if cost > limit else ''}")
+
+    print("  Slowest modules outside savethespice:")
+    top_level = {
+        module: cost
+        for module, cost in times.items()
+        if "." not in module and module != "savethespice"
+    }
+    for module, cost in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:5]:
+        print(f"    {module}: {cost:.0f}")
+
+    return failures
+
+
+def main() -> int:
+    budget = json.loads(BUDGET_PATH.read_text())
+    failures = [
+        failure
+        for entry, entry_budget in budget["entries"].items()
+        for failure in check(
+            entry,
+            entry_budget["modules"],
+            budget["deferred"] + entry_budget.get("deferred", []),
+        )
+    ]
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Compare decoding a large `GetRecipesResponse` from DynamoDB items through boto3's resource layer
+and serializing it with FastAPI's defaults against the fast and trusted paths the read endpoints
+opt into, checking that all of them give the same bytes.
+"""
+import asyncio
+import os
+from timeit import repeat
+
+# Settings are required to import the app's modules, though nothing here touches AWS
+for name in (
+    "client_id",
+    "user_pool_id",
+    "recipes_table_name",
+    "categories_table_name",
+    "meta_table_name",
+    "images_bucket_name",
+):
+    os.environ.setdefault(name, "benchmark")
+
+from boto3.dynamodb.types import TypeDeserializer  # noqa: E402
+from fastapi import Response  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from savethespice.crud.codec import serialize_item  # noqa: E402
+from savethespice.crud.common import decode_item  # noqa: E402
+from savethespice.lib.responses import get_fast_response  # noqa: E402
+from savethespice.models import GetRecipesResponse, Recipe  # noqa: E402
+
+RECIPE_COUNT = 5000
+REPEATS = 5
+_deserializer = TypeDeserializer()
+
+
+def get_items() -> list[dict]:
+    """
+    Get recipes as the low-level client returns them from the table.
+    """
+    return [
+        serialize_item(
+            dict(
+                recipeId=recipe_id,
+                name=f"Recipe {recipe_id} – crème brûlée",
+                desc="A short description of the recipe.",
+                cookTime="45 minutes",
+                yields="4 servings",
+                ingredients=[f"{i + 1} cups of ingredient {i}" for i in range(12)],
+                instructions=[f'Step {i + 1}: do the "thing" for a while.\n' for i in range(8)],
+                categories=set(range(recipe_id % 5)),
+                url=f"https://example.com/recipes/{recipe_id}",
+                imgSrc=f"https://images.example.com/{recipe_id}.jpg",
+                imgVariants={"thumbnail": f"https://images.example.com/{recipe_id}-thumbnail.jpg"},
+                createTime="2022-01-01T00:00:00+00:00",
+                updateTime="2022-01-02T00:00:00+00:00",
+            )
+        )
+        for recipe_id in range(RECIPE_COUNT)
+    ]
+
+
+def deserialize(item: dict) -> dict:
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+def serialize_default(items: list[dict]) -> bytes:
+    content = {
+        "data": {"recipes": [Recipe(**deserialize(item)) for item in items], "nextToken": None}
+    }
+    field = create_response_field(name="Response_get_recipes", type_=GetRecipesResponse)
+    return JSONResponse(asyncio.run(serialize_response(field=field, response_content=content))).body
+
+
+def serialize_fast(items: list[dict]) -> bytes:
+    content = {
+        "data": {"recipes": [Recipe(**deserialize(item)) for item in items], "nextToken": None}
+    }
+    return get_fast_response(GetRecipesResponse, content, Response()).body
+
+
+def serialize_trusted(items: list[dict]) -> bytes:
+    content = {
+        "data": {"recipes": [decode_item(Recipe, item) for item in items], "nextToken": None}
+    }
+    return get_fast_response(GetRecipesResponse, content, Response(), validate=False).body
+
+
+def main() -> None:
+    items = get_items()
+    paths = {"default": serialize_default, "fast": serialize_fast, "trusted": serialize_trusted}
+    default_body = serialize_default(items)
+    for name, serialize in paths.items():
+        assert serialize(items) == default_body, f"The {name} path gave different bytes."
+
+    print(f"Serializing {RECIPE_COUNT} recipes ({len(default_body) / 1024 / 1024:.1f} MiB):")
+    for name, serialize in paths.items():
+        best = min(repeat(lambda: serialize(items), number=1, repeat=REPEATS))
+        print(f"  {name}: {best * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+from mangum import Mangum
+
+from savethespice.apps.common import create_app
+from savethespice.routes.auth import api as auth
+
+app = create_app(auth)
+handler = Mangum(app)
@@ -0,0 +1,106 @@
+import os
+from collections import Callable
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from savethespice.crud.common import UnprocessedKeysError
+from savethespice.lib.common import root_logger as logging
+
+OPENAPI_TAGS = [
+    {"name": "auth", "description": "Authentication related operations."},
+    {"name": "categories", "description": "Category related operations."},
+    {"name": "recipes", "description": "Recipe related operations."},
+    {"name": "shoppinglist", "description": "Shopping list related operations."},
+    {"name": "share", "description": "Sharing related operations."},
+]
+
+
+def unique_id_function(route: APIRoute):
+    return f"{route.tags[0]}-{route.name}"
+
+
+def create_app(*routers: APIRouter) -> FastAPI:
+    """
+    Create an app serving the given routers, so that each Lambda function only imports the code
+    for the routes it serves.
+
+    :param routers: Routers to include
+    :return: App with the middleware and exception handlers shared by every function
+    """
+    tags = {tag for router in routers for tag in router.tags}
+    app = FastAPI(
+        title="SaveTheSpice",
+        version="0.1.0",
+        description="Recipe saver.",
+        generate_unique_id_function=unique_id_function,
+        openapi_tags=[tag for tag in OPENAPI_TAGS if tag["name"] in tags],
+    )
+    for router in routers:
+        app.include_router(router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost",
+            "http://localhost:5001",
+            # Only set when serving locally
+            f"http://localhost:{os.environ.get('UVICORN_PORT', 8000)}",
+        ],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        max_age=86400,
+    )
+    app.middleware("http")(add_user_id)
+    app.add_exception_handler(Exception, base_exception_handler)
+    app.add_exception_handler(status.HTTP_405_METHOD_NOT_ALLOWED, method_not_allowed_handler)
+    app.add_exception_handler(NotImplementedError, method_not_implemented_handler)
+    app.add_exception_handler(AssertionError, assertion_error_handler)
+    app.add_exception_handler(UnprocessedKeysError, unprocessed_keys_error_handler)
+
+    return app
+
+
+async def add_user_id(req: Request, call_next: Callable):
+    event = req.scope.get("aws.event")
+    req.scope["USER_ID"] = (
+        event["requestContext"].get("authorizer", {}).get("claims", {}).get("sub", "None")
+        if event
+        else "00000000-0000-0000-0000-000000000000"
+    )
+    return await call_next(req)
+
+
+def base_exception_handler(req: Request, e: Exception):
+    message = "Unexpected exception occured."
+    logging.exception(message)
+    return JSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": message}
+    )
+
+
+def method_not_allowed_handler(req: Request, e: HTTPException):
+    return JSONResponse(
+        status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+        content={"message": "Unsupported HTTP method."},
+    )
+
+
+async def method_not_implemented_handler(req: Request, e: NotImplementedError):
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND, content={"message": "Method not implemented."}
+    )
+
+
+def assertion_error_handler(req: Request, e: AssertionError):
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"message": e.args[0]})
+
+
+def unprocessed_keys_error_handler(req: Request, e: UnprocessedKeysError):
+    logging.error(f"Failed to read keys {e.args[0]}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"message": "Failed to read some items, try again later."},
+    )
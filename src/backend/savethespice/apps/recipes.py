@@ -0,0 +1,8 @@
+from mangum import Mangum
+
+from savethespice.apps.common import create_app
+from savethespice.routes.categories import api as categories
+from savethespice.routes.recipes import api as recipes
+
+app = create_app(categories, recipes)
+handler = Mangum(app)
@@ -0,0 +1,7 @@
+from mangum import Mangum
+
+from savethespice.apps.common import create_app
+from savethespice.routes.share import api as share
+
+app = create_app(share)
+handler = Mangum(app)
@@ -0,0 +1,7 @@
+from mangum import Mangum
+
+from savethespice.apps.common import create_app
+from savethespice.routes.shopping_list import api as shopping_list
+
+app = create_app(shopping_list)
+handler = Mangum(app)
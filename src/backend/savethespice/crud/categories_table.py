@@ -1,129 +1,368 @@
 import os
-from collections import Generator, Iterable
-from functools import cache
-from itertools import count
-from typing import Optional, cast
+from collections import Generator, Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Literal, Optional
 
-import boto3
 from boto3.dynamodb.conditions import Attr
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient, Table
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+from botocore.exceptions import ClientError
 
 from savethespice.crud.common import (
+    QueryPlan,
+    UnprocessedKeysError,
+    batch_write_to_table,
+    decode_item,
     format_query_fields,
+    get_client,
     get_item_from_table,
     get_items_from_table,
+    iter_query_table,
     query_table,
+    query_table_page,
     remove_item_from_table,
+    update_item_in_table,
     upsert_to_table,
 )
-from savethespice.crud.meta_table import get_next_id
+from savethespice.crud.meta_table import (
+    get_next_ids,
+    invalidate_category_index,
+    set_last_modified,
+)
 from savethespice.lib.common import root_logger
 from savethespice.models import Category, CategoryBase
 
+# Global secondary index keyed on (userId, name)
+CATEGORY_NAME_INDEX = "userId-name-index"
+CATEGORY_REQUEST_CONCURRENCY = 8
 logging = root_logger.getChild(__name__)
 
+CATEGORY_FIELDS = ["categoryId", "name", "updateTime", "createTime"]
+_CATEGORY_PROJECTION = format_query_fields(CATEGORY_FIELDS)
+_NAME_PROJECTION = format_query_fields(["name"])
+_ID_PROJECTION = format_query_fields(["categoryId"])
+_RECIPE_IDS_PROJECTION = format_query_fields(["categoryId", "recipeIds"])
+_CATEGORIES_QUERY = QueryPlan("userId", CATEGORY_FIELDS)
+_CATEGORY_IDS_BY_NAME_QUERY = QueryPlan(
+    "userId",
+    index_name=CATEGORY_NAME_INDEX,
+    key_condition="#name = :name",
+    attribute_names=["name"],
+)
 
-@cache
-def _get_table() -> tuple[Table, DynamoDBClient]:
-    client: DynamoDBClient = boto3.client("dynamodb")
-    table = boto3.resource("dynamodb").Table(os.environ["categories_table_name"])
 
-    return table, client
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["categories_table_name"], get_client()
 
 
 def get(user_id: str, category_id: int) -> Optional[Category]:
-    table, _ = _get_table()
-    kwargs = format_query_fields(["categoryId", "name", "updateTime", "createTime"])
+    table, client = _get_table()
 
-    item = get_item_from_table(table, key={"userId": user_id, "categoryId": category_id}, **kwargs)
+    item = get_item_from_table(
+        client, table, key={"userId": user_id, "categoryId": category_id}, **_CATEGORY_PROJECTION
+    )
 
-    return Category(**item) if item else None
+    return decode_item(Category, item) if item else None
 
 
 def get_category_names_by_id(user_id: str, category_ids: list[int]) -> list[str]:
     table, client = _get_table()
-    kwargs = format_query_fields(["name"])
 
-    items = get_items_from_table(
+    items, unprocessed_keys = get_items_from_table(
         client,
-        table.name,
+        table,
         keys=[{"userId": user_id, "categoryId": category_id} for category_id in category_ids],
-        **kwargs,
+        **_NAME_PROJECTION,
     )
+    if unprocessed_keys:
+        raise UnprocessedKeysError(unprocessed_keys)
 
     # Convert from DDB format
     return [item["name"]["S"] for item in items]
 
 
+def get_existing_ids(user_id: str, category_ids: Iterable[int]) -> set[int]:
+    table, client = _get_table()
+
+    items, unprocessed_keys = get_items_from_table(
+        client,
+        table,
+        keys=[{"userId": user_id, "categoryId": category_id} for category_id in category_ids],
+        **_ID_PROJECTION,
+    )
+    if unprocessed_keys:
+        raise UnprocessedKeysError(unprocessed_keys)
+
+    return {int(item["categoryId"]["N"]) for item in items}
+
+
+def get_category_ids_by_name(user_id: str, names: Iterable[str]) -> dict[str, int]:
+    """
+    Look up categories by name through the name index, one query per name.
+
+    :param user_id: ID of the user
+    :param names: Names of the categories
+    :return: IDs of the categories that exist by name
+    """
+    table, client = _get_table()
+
+    def _get_category_ids(name: str) -> list[dict[str, Any]]:
+        return query_table(
+            client, table, _CATEGORY_IDS_BY_NAME_QUERY, {"userId": user_id, "name": name}
+        )
+
+    names = set(names)
+    with ThreadPoolExecutor(max_workers=CATEGORY_REQUEST_CONCURRENCY) as executor:
+        return {
+            item["name"]["S"]: int(item["categoryId"]["N"])
+            for items in executor.map(_get_category_ids, names)
+            for item in items
+        }
+
+
 def get_all(user_id: str) -> Generator[Category, None, None]:
-    table, _ = _get_table()
-    kwargs = format_query_fields(["categoryId", "name", "updateTime", "createTime"])
+    table, client = _get_table()
 
-    # TODO: Paginate
-    return (Category(**c) for c in query_table(table, key=("userId", user_id), **kwargs))
+    return (
+        decode_item(Category, c)
+        for c in iter_query_table(client, table, _CATEGORIES_QUERY, {"userId": user_id})
+    )
+
+
+def get_page(
+    user_id: str, limit: int, next_token: Optional[str] = None
+) -> tuple[list[Category], Optional[str]]:
+    """
+    Get a single page of categories.
 
+    :param user_id: ID of the user
+    :param limit: Maximum number of categories to return
+    :param next_token: Token from a previous page, if continuing
+    :return: (Categories in the page, Token for the next page if there are more categories)
+    """
+    table, client = _get_table()
 
-def delete(user_id, category_id: int) -> None:
-    table, _ = _get_table()
-    remove_item_from_table(
+    items, next_token = query_table_page(
+        client,
+        table,
+        _CATEGORIES_QUERY,
+        {"userId": user_id},
+        key_types={"categoryId": int},
+        limit=limit,
+        next_token=next_token,
+    )
+
+    return [decode_item(Category, c) for c in items], next_token
+
+
+def delete(user_id, category_id: int) -> set[int]:
+    """
+    :return: IDs of the recipes in the category
+    """
+    table, client = _get_table()
+    item = remove_item_from_table(
+        client,
         table,
         key={"userId": user_id, "categoryId": category_id},
         ConditionExpression=Attr("userId").exists() & Attr("categoryId").exists(),
+        ReturnValues="ALL_OLD",
+    )
+    set_last_modified(user_id, "categories")
+
+    return item.get("recipeIds", set())
+
+
+def delete_many(user_id: str, category_ids: Iterable[int]) -> tuple[set[int], list[int]]:
+    """
+    Delete categories in bulk.
+
+    :param user_id: ID of the user
+    :param category_ids: IDs of the categories to delete
+    :return: (IDs of the recipes in the deleted categories, IDs of categories that failed to be
+              deleted)
+    """
+    table, client = _get_table()
+    category_ids = list(dict.fromkeys(category_ids))
+
+    # Single read for existence and recipes, since BatchWriteItem can't be conditional
+    recipe_ids: dict[int, list[str]] = {}
+    items, unprocessed_keys = get_items_from_table(
+        client,
+        table,
+        keys=[{"userId": user_id, "categoryId": category_id} for category_id in category_ids],
+        **_RECIPE_IDS_PROJECTION,
     )
+    for item in items:
+        recipe_ids[int(item["categoryId"]["N"])] = item.get("recipeIds", {}).get("NS", [])
+
+    failed_requests = batch_write_to_table(
+        client,
+        table,
+        requests=[
+            {"DeleteRequest": {"Key": {"userId": user_id, "categoryId": category_id}}}
+            for category_id in recipe_ids
+        ],
+    )
+    failed_ids = {request["DeleteRequest"]["Key"]["categoryId"] for request in failed_requests}
+    # Including those that couldn't be read to check that they exist
+    failed_ids.update(key["categoryId"] for key in unprocessed_keys)
+    failed_ids.update(category_id for category_id in category_ids if category_id not in recipe_ids)
+    if len(failed_ids) < len(category_ids):
+        set_last_modified(user_id, "categories")
+
+    return {
+        int(recipe_id)
+        for category_id, category_recipe_ids in recipe_ids.items()
+        if category_id not in failed_ids
+        for recipe_id in category_recipe_ids
+    }, [category_id for category_id in category_ids if category_id in failed_ids]
+
+
+def update(user_id: str, category_id: int, body: CategoryBase) -> None:
+    """
+    Update an existing category, raising ConditionalCheckFailedException if it doesn't exist.
+    """
+    _update(user_id, category_id, body)
+    set_last_modified(user_id, "categories")
+
+
+def _update(user_id: str, category_id: int, body: CategoryBase) -> None:
+    table, client = _get_table()
+    upsert_to_table(
+        client,
+        table,
+        key={"userId": user_id, "categoryId": category_id},
+        item=body,
+        ConditionExpression=Attr("categoryId").exists(),
+    )
+
+
+def update_many(user_id: str, bodies: Mapping[int, CategoryBase]) -> list[int]:
+    """
+    Update existing categories in parallel.
+
+    :param user_id: ID of the user
+    :param bodies: Updates to make, by category ID
+    :return: IDs of categories that don't exist or failed to be updated
+    """
+    _, client = _get_table()
+
+    def _update_category(category_id: int, body: CategoryBase) -> bool:
+        try:
+            _update(user_id, category_id, body)
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+        except ClientError:
+            logging.exception(f"Failed to update category with ID {category_id}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=CATEGORY_REQUEST_CONCURRENCY) as executor:
+        updated = list(executor.map(_update_category, bodies.keys(), bodies.values()))
+    if any(updated):
+        set_last_modified(user_id, "categories")
+
+    return [category_id for category_id, is_updated in zip(bodies, updated) if not is_updated]
 
 
 def upsert(user_id: str, category_id: int, body: CategoryBase) -> Category:
-    table, _ = _get_table()
+    table, client = _get_table()
     create_time, update_time = upsert_to_table(
-        table, key={"categoryId": category_id, "userId": user_id}, item=body
+        client, table, key={"categoryId": category_id, "userId": user_id}, item=body
     )
+    set_last_modified(user_id, "categories")
 
     return Category(
         **body.dict(), categoryId=category_id, createTime=create_time, updateTime=update_time
     )
 
 
+def update_recipe_index(
+    user_id: str,
+    *,
+    added: Optional[Mapping[int, Iterable[int]]] = None,
+    removed: Optional[Mapping[int, Iterable[int]]] = None,
+) -> bool:
+    """
+    Update the IDs of the recipes in each category, kept on the category so that deleting it
+    only touches the recipes that reference it. If any update fails, the user's index is
+    invalidated so that it's rebuilt from their recipes before a category is next deleted.
+
+    :param user_id: ID of the user
+    :param added: IDs of recipes added to each category, by category ID
+    :param removed: IDs of recipes removed from each category, by category ID
+    :return: Whether every update succeeded
+    """
+    table, client = _get_table()
+
+    def _update(action: Literal["ADD", "DELETE"], category_id: int, recipe_ids: set[int]) -> bool:
+        if not recipe_ids:
+            return True
+        kwargs = format_query_fields(
+            {"recipeIds": recipe_ids},
+            projection_expression=False,
+            attribute_names=True,
+            attribute_values=True,
+        )
+        try:
+            update_item_in_table(
+                client,
+                table,
+                key={"userId": user_id, "categoryId": category_id},
+                UpdateExpression=f"{action} #recipeIds :recipeIds",
+                # Don't recreate deleted categories
+                ConditionExpression=Attr("categoryId").exists(),
+                **kwargs,
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            pass
+        except ClientError:
+            logging.exception(f"Failed to update recipes in category with ID {category_id}")
+            return False
+        return True
+
+    updates = [
+        (action, category_id, set(recipe_ids))
+        for action, recipe_ids_by_category in (("ADD", added or {}), ("DELETE", removed or {}))
+        for category_id, recipe_ids in recipe_ids_by_category.items()
+    ]
+    with ThreadPoolExecutor(max_workers=CATEGORY_REQUEST_CONCURRENCY) as executor:
+        updated = all(list(executor.map(lambda update: _update(*update), updates)))
+    if not updated:
+        invalidate_category_index(user_id)
+
+    return updated
+
+
 def add_categories_by_name(
     user_id: str, categories: Iterable[str]
-) -> tuple[list[int], list[Category], list[str]]:
+) -> tuple[dict[str, int], list[Category], list[str]]:
     """
     Add categories that don't already exist by name.
 
     :param user_id: ID of the user
     :param categories: Names of the categories being added in the recipe request
-    :return: (Existing category entries found by name, New category entries, Any failed category
+    :return: (Existing category IDs found by name, New category entries, Any failed category
               additions)
     """
     if not categories:
-        return [], [], []
+        return {}, [], []
     categories = set(categories)
     table, client = _get_table()
-    kwargs = format_query_fields(["categoryId", "name", "createTime", "updateTime"])
-    existing_categories: list[Category] = [
-        Category(**category)
-        for category in query_table(
-            table,
-            key=("userId", user_id),
-            FilterExpression=Attr("name").is_in(cast(list[str], categories)),
-            **kwargs,
-        )
-    ]
-    categories_to_return = [
-        category.categoryId for category in existing_categories if category.name in categories
-    ]
+    categories_to_return = get_category_ids_by_name(user_id, categories)
 
-    if categories_to_add := categories.difference(
-        category.name for category in existing_categories
-    ):
-        logging.info(f"Adding categories {categories_to_add} to user with ID {user_id}.")
     new_categories: list[Category] = []
     failed_adds: list[str] = []
-    next_category_id = get_next_id(user_id, "category")
-    for name, category_id in zip(categories_to_add, count(next_category_id)):
+    categories_to_add = categories.difference(categories_to_return)
+    if not categories_to_add:
+        return categories_to_return, new_categories, failed_adds
+
+    logging.info(f"Adding categories {categories_to_add} to user with ID {user_id}.")
+    category_ids = get_next_ids(user_id, "category", len(categories_to_add))
+    for name, category_id in zip(categories_to_add, category_ids):
         body = CategoryBase(name=name)
         try:
             create_time, update_time = upsert_to_table(
-                table, key={"categoryId": category_id, "userId": user_id}, item=body
+                client, table, key={"categoryId": category_id, "userId": user_id}, item=body
             )
         except Exception:
             logging.exception(f"{name} failed to be created")
@@ -137,5 +376,7 @@ def add_categories_by_name(
                     categoryId=category_id,
                 )
             )
+    if new_categories:
+        set_last_modified(user_id, "categories")
 
     return categories_to_return, new_categories, failed_adds
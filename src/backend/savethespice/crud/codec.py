@@ -0,0 +1,98 @@
+from collections import Mapping
+from decimal import Decimal
+from typing import Any, Callable
+
+# Our tables hold strings, integers, lists and maps of strings, and sets of integers or strings, so
+# the checks for those come first and numbers are read as ints unless they have a fractional part
+
+
+def serialize(value: Any) -> dict[str, Any]:
+    """
+    Convert a Python value into a DynamoDB attribute value.
+    """
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, (int, Decimal)):
+        return {"N": str(value)}
+    if isinstance(value, (list, tuple)):
+        return {"L": [serialize(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        return _serialize_set(value)
+    if isinstance(value, Mapping):
+        return {"M": serialize_item(value)}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, bytes):
+        return {"B": value}
+    raise TypeError(f"Unsupported type {type(value)} for value {value}")
+
+
+def _serialize_set(value: set[Any]) -> dict[str, Any]:
+    if not value:
+        # DynamoDB has no empty sets, and an empty set is read the same as a missing one
+        return {"NULL": True}
+    if all(isinstance(v, str) for v in value):
+        return {"SS": list(value)}
+    if all(isinstance(v, (int, Decimal)) and not isinstance(v, bool) for v in value):
+        return {"NS": [str(v) for v in value]}
+    raise TypeError(f"Unsupported set {value}, sets must hold only strings or only numbers")
+
+
+def serialize_item(item: Mapping[str, Any]) -> dict[str, dict[str, Any]]:
+    return {k: serialize(v) for k, v in item.items()}
+
+
+def deserialize(value: dict[str, Any]) -> Any:
+    """
+    Convert a DynamoDB attribute value into a Python value.
+    """
+    ((type_, data),) = value.items()
+    return _DESERIALIZERS[type_](data)
+
+
+def deserialize_item(item: Mapping[str, dict[str, Any]]) -> dict[str, Any]:
+    return {k: deserialize(v) for k, v in item.items()}
+
+
+def deserialize_field(value: dict[str, Any]) -> Any:
+    """
+    Convert a DynamoDB attribute value into the value a model field would be validated into,
+    reading sets as lists.
+    """
+    ((type_, data),) = value.items()
+    if type_ == "S":
+        return data
+    if type_ == "N":
+        return _deserialize_number(data)
+    if type_ == "L" and all("S" in v for v in data):
+        return [v["S"] for v in data]
+    if type_ == "NS":
+        return [_deserialize_number(v) for v in data]
+    if type_ == "SS":
+        return data
+    if type_ == "M" and all("S" in v for v in data.values()):
+        return {k: v["S"] for k, v in data.items()}
+    return deserialize(value)
+
+
+def _deserialize_number(data: str) -> Any:
+    try:
+        return int(data)
+    except ValueError:
+        return Decimal(data)
+
+
+_DESERIALIZERS: dict[str, Callable[[Any], Any]] = {
+    "S": str,
+    "N": _deserialize_number,
+    "L": lambda data: [deserialize(v) for v in data],
+    "NS": lambda data: {_deserialize_number(v) for v in data},
+    "SS": set,
+    "M": deserialize_item,
+    "BOOL": bool,
+    "NULL": lambda _: None,
+    "B": bytes,
+    "BS": set,
+}
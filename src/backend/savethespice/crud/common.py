@@ -1,22 +1,136 @@
-from collections import Iterable, Mapping
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from functools import singledispatch
-from typing import Any, Literal, Optional, Union
+from functools import cache, singledispatch
+from time import sleep
+from typing import Any, Literal, Optional, TypeVar, Union
 
-from boto3.dynamodb.conditions import Key
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient, Table
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+from botocore.exceptions import ClientError
+from pydantic import BaseModel
 
+from savethespice.crud.codec import (
+    deserialize_field,
+    deserialize_item,
+    serialize_item,
+)
+from savethespice.lib.common import chunks, jittered_backoff, root_logger
 from savethespice.models import CategoryBase, RecipeBase
 
+logging = root_logger.getChild(__name__)
+M = TypeVar("M", bound=BaseModel)
+
+BATCH_GET_CONCURRENCY = 4
+
+RETRYABLE_ERROR_CODES = {
+    "InternalServerError",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+    "TransactionConflictException",
+    "TransactionInProgressException",
+}
+# Reasons a transaction item can be cancelled for that don't prevent retrying the rest, "None"
+# being given for items that didn't cause the cancellation
+RETRYABLE_CANCELLATION_REASONS = {
+    "None",
+    "ConditionalCheckFailed",
+    "ProvisionedThroughputExceeded",
+    "ThrottlingError",
+    "TransactionConflict",
+}
+
+
+class UnprocessedKeysError(Exception):
+    """
+    Raised when items that may exist couldn't be read, so a partial result isn't mistaken for a
+    complete one.
+    """
+
+    pass
+
+
+@cache
+def get_client() -> DynamoDBClient:
+    """
+    Get the low-level client shared by all tables.
+    """
+    return boto3.client("dynamodb")
+
+
+class QueryPlan:
+    """
+    Parameters of a query on a partition, compiled once so that each query only adds its values.
+    """
+
+    def __init__(
+        self,
+        key_name: str,
+        fields: Optional[Iterable[str]] = None,
+        *,
+        index_name: Optional[str] = None,
+        key_condition: Optional[str] = None,
+        filter_expression: Optional[str] = None,
+        attribute_names: Iterable[str] = (),
+    ):
+        """
+        :param key_name: Name of the partition key, whose value is referred to as `:{key_name}`
+        :param fields: Fields to get, or None for all of them
+        :param index_name: Index to query, if not the table
+        :param key_condition: Condition on the sort key, on top of the one on the partition key
+        :param filter_expression: Condition items have to meet to be returned
+        :param attribute_names: Names the conditions refer to as `#{name}`
+        """
+        fields = list(fields or [])
+        self.key_name = key_name
+        self.kwargs: dict[str, Any] = {
+            "KeyConditionExpression": " AND ".join(
+                filter(None, [f"#{key_name} = :{key_name}", key_condition])
+            ),
+            **format_query_fields(
+                list(dict.fromkeys([key_name, *fields, *attribute_names])),
+                projection_expression=False,
+            ),
+        }
+        if fields:
+            self.kwargs.update(format_query_fields(fields, attribute_names=False))
+        if index_name:
+            self.kwargs["IndexName"] = index_name
+        if filter_expression:
+            self.kwargs["FilterExpression"] = filter_expression
+
+    def get_request(self, table_name: str, values: Mapping[str, Any], **kwargs) -> dict[str, Any]:
+        """
+        :param table_name: Name of the table to query
+        :param values: Values the conditions refer to as `:{name}`, including the partition key
+        :return: Query request for the low-level client
+        """
+        return {
+            "TableName": table_name,
+            **self.kwargs,
+            "ExpressionAttributeValues": serialize_item({f":{k}": v for k, v in values.items()}),
+            **kwargs,
+        }
+
+
+def get_edit_time() -> str:
+    return datetime.now(tz=timezone.utc).replace(microsecond=0).isoformat()
+
 
 def upsert_to_table(
-    table: Table,
+    client: DynamoDBClient,
+    table_name: str,
     *,
     key: dict[str, Any],
     item: Optional[Union[RecipeBase, CategoryBase]] = None,
     **kwargs,
 ) -> tuple[str, str]:
-    edit_time = datetime.now(tz=timezone.utc).replace(microsecond=0).isoformat()
+    edit_time = get_edit_time()
     item = {k: v for k, v in item.dict().items() if v != "" and v is not None} if item else {}
     update_args = {
         "UpdateExpression": (
@@ -40,42 +154,335 @@ def upsert_to_table(
             }.items()
         },
     }
-    res = table.update_item(Key=key, ReturnValues="ALL_NEW", **update_args, **kwargs)
-    return res["Attributes"]["createTime"], res["Attributes"]["updateTime"]
+    item = update_item_in_table(
+        client, table_name, key=key, ReturnValues="ALL_NEW", **update_args, **kwargs
+    )
+    return item["createTime"], item["updateTime"]
 
 
-def remove_item_from_table(table: Table, *, key: dict[str, Any], **kwargs) -> dict[str, Any]:
-    return table.delete_item(Key=key, **kwargs)
+def update_item_in_table(
+    client: DynamoDBClient, table_name: str, *, key: dict[str, Any], **kwargs
+) -> dict[str, Any]:
+    """
+    :return: Attributes returned by the update, in the native (non-DDB) format
+    """
+    request = _get_request(table_name, Key=key, **kwargs)
+    return deserialize_item(client.update_item(**request).get("Attributes", {}))
 
 
-def get_item_from_table(table: Table, *, key: dict[str, Any], **kwargs) -> dict[str, Any]:
-    return table.get_item(Key=key, **kwargs).get("Item", {})
+def put_item_in_table(
+    client: DynamoDBClient, table_name: str, *, item: dict[str, Any], **kwargs
+) -> None:
+    client.put_item(**_get_request(table_name, Item=item, **kwargs))
 
 
-def get_items_from_table(
-    client: DynamoDBClient, table_name: str, *, keys: list[dict[str, Any]], **kwargs
-) -> list[dict[str, dict[Literal["S", "N"], str]]]:
-    return (
-        client.batch_get_item(
-            RequestItems={
-                table_name: {
-                    "Keys": [
-                        {k: {("N" if isinstance(v, int) else "S"): str(v)} for k, v in key.items()}
-                        for key in keys
-                    ],
-                    **kwargs,
-                }
+def remove_item_from_table(
+    client: DynamoDBClient, table_name: str, *, key: dict[str, Any], **kwargs
+) -> dict[str, Any]:
+    """
+    :return: Attributes returned by the delete, in the native (non-DDB) format
+    """
+    request = _get_request(table_name, Key=key, **kwargs)
+    return deserialize_item(client.delete_item(**request).get("Attributes", {}))
+
+
+def batch_write_to_table(
+    client: DynamoDBClient,
+    table_name: str,
+    *,
+    requests: list[dict[str, Any]],
+    max_attempts: int = 5,
+) -> list[dict[str, Any]]:
+    """
+    Write to a table with BatchWriteItem in chunks of 25, retrying unprocessed items.
+
+    :param client: DynamoDB client
+    :param table_name: Name of the table to write to
+    :param requests: PutRequest or DeleteRequest entries, in the native (non-DDB) format
+    :param max_attempts: Maximum number of attempts for each chunk
+    :return: Requests that could not be processed, in the native (non-DDB) format
+    :raises ClientError: If a chunk fails with an error that retrying won't fix
+    """
+    failed_requests = []
+    for chunk in chunks(requests, batch_size=25):
+        chunk = [
+            {
+                action: {name: serialize_item(value) for name, value in entry.items()}
+                for action, entry in request.items()
+            }
+            for request in chunk
+            if request  # Filter Nones
+        ]
+        for attempt in range(max_attempts):
+            if attempt:
+                sleep(jittered_backoff(attempt))
+            try:
+                res = client.batch_write_item(RequestItems={table_name: chunk})
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in RETRYABLE_ERROR_CODES:
+                    raise
+                logging.info(f"Response: {e.response}")
+                continue
+            if not (chunk := res.get("UnprocessedItems", {}).get(table_name, [])):
+                break
+        failed_requests.extend(
+            {
+                action: {name: deserialize_item(value) for name, value in entry.items()}
+                for action, entry in request.items()
             }
+            for request in chunk
         )
-        .get("Responses", {})
-        .get(table_name, [])
-    )
+
+    return failed_requests
+
+
+def transact_write_to_table(
+    client: DynamoDBClient, *, items: list[dict[str, Any]], max_attempts: int = 5
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """
+    Write up to 25 items in a transaction, retrying with backoff while it's cancelled by conflicts
+    or throttling. Items whose condition check fails are left out of the retries.
+
+    :param client: DynamoDB client
+    :param items: TransactItems entries, in the DDB format
+    :param max_attempts: Maximum number of attempts
+    :return: (Items written, Items that failed to be written, excluding failed condition checks)
+    """
+    for attempt in range(max_attempts):
+        if attempt:
+            sleep(jittered_backoff(attempt))
+        try:
+            client.transact_write_items(TransactItems=items)
+        except ClientError as e:
+            logging.info(f"Response: {e.response}")
+            items, retryable = _get_retryable_transact_items(items, e.response)
+            if not retryable:
+                return [], items
+            if not items:
+                return [], []
+        else:
+            return items, []
+
+    return [], items
+
+
+def _get_retryable_transact_items(
+    items: list[dict[str, Any]], response: dict[str, Any]
+) -> tuple[list[dict[str, Any]], bool]:
+    """
+    :return: (Items without failed condition checks, Whether the transaction can be retried)
+    """
+    code = response["Error"]["Code"]
+    if code != "TransactionCanceledException":
+        return items, code in RETRYABLE_ERROR_CODES
+
+    reasons = [reason.get("Code", "None") for reason in response.get("CancellationReasons", [])]
+    if len(reasons) != len(items):
+        return items, True
+
+    return [
+        item for item, reason in zip(items, reasons) if reason != "ConditionalCheckFailed"
+    ], all(reason in RETRYABLE_CANCELLATION_REASONS for reason in reasons)
+
+
+def _get_request(table_name: str, **kwargs) -> dict[str, Any]:
+    """
+    Build a request for the low-level client from native keys, items and values, and from
+    conditions built with `Key` and `Attr`.
+    """
+    request = {"TableName": table_name, **kwargs}
+    for name in ("Key", "Item"):
+        if name in request:
+            request[name] = serialize_item(request[name])
+    names = request.pop("ExpressionAttributeNames", {})
+    values = serialize_item(request.pop("ExpressionAttributeValues", {}))
+
+    builder = ConditionExpressionBuilder()
+    for name in ("ConditionExpression", "FilterExpression"):
+        if isinstance(condition := request.get(name), ConditionBase):
+            expression = builder.build_expression(condition)
+            request[name] = expression.condition_expression
+            names = {**names, **expression.attribute_name_placeholders}
+            values.update(serialize_item(expression.attribute_value_placeholders))
+
+    if names:
+        request["ExpressionAttributeNames"] = names
+    if values:
+        request["ExpressionAttributeValues"] = values
+    return request
+
+
+def get_item_from_table(
+    client: DynamoDBClient, table_name: str, *, key: dict[str, Any], **kwargs
+) -> dict[str, dict[str, Any]]:
+    """
+    :return: Item found, in the DDB format, or an empty dict if it doesn't exist
+    """
+    return client.get_item(**_get_request(table_name, Key=key, **kwargs)).get("Item", {})
+
+
+def get_items_from_table(
+    client: DynamoDBClient,
+    table_name: str,
+    *,
+    keys: list[dict[str, Any]],
+    max_attempts: int = 5,
+    **kwargs,
+) -> tuple[list[dict[str, dict[Literal["S", "N"], str]]], list[dict[str, Any]]]:
+    """
+    Read from a table with BatchGetItem in parallel chunks of 100 keys, retrying unprocessed keys.
+
+    :param client: DynamoDB client
+    :param table_name: Name of the table to read from
+    :param keys: Keys of the items, in the native (non-DDB) format
+    :param max_attempts: Maximum number of attempts for each chunk
+    :return: (Items found, in the DDB format and in no particular order, Keys that still couldn't be
+              read after `max_attempts`, in the native (non-DDB) format)
+    """
+
+    def _get_items(
+        chunk: tuple[Optional[dict[str, Any]]]
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        request_keys = [serialize_item(key) for key in chunk if key]  # Filter Nones
+        items = []
+        for attempt in range(max_attempts):
+            if attempt:
+                sleep(jittered_backoff(attempt))
+            try:
+                res = client.batch_get_item(
+                    RequestItems={table_name: {"Keys": request_keys, **kwargs}}
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in RETRYABLE_ERROR_CODES:
+                    raise
+                logging.info(f"Response: {e.response}")
+                continue
+            items.extend(res.get("Responses", {}).get(table_name, []))
+            if not (request_keys := res.get("UnprocessedKeys", {}).get(table_name, {}).get("Keys")):
+                return items, []
+
+        logging.error(f"Failed to read keys {request_keys} from {table_name}")
+        return items, [deserialize_item(key) for key in request_keys]
+
+    items, unprocessed_keys = [], []
+    with ThreadPoolExecutor(max_workers=BATCH_GET_CONCURRENCY) as executor:
+        for chunk_items, chunk_unprocessed_keys in executor.map(
+            _get_items, chunks(keys, batch_size=100)
+        ):
+            items.extend(chunk_items)
+            unprocessed_keys.extend(chunk_unprocessed_keys)
+
+    return items, unprocessed_keys
 
 
 def query_table(
-    table: Table, *, key: tuple[str, Union[int, str]], **kwargs
-) -> list[dict[str, Any]]:
-    return table.query(KeyConditionExpression=Key(key[0]).eq(key[1]), **kwargs).get("Items", [])
+    client: DynamoDBClient, table_name: str, plan: QueryPlan, values: Mapping[str, Any]
+) -> list[dict[str, dict[str, Any]]]:
+    return list(iter_query_table(client, table_name, plan, values))
+
+
+def iter_query_table(
+    client: DynamoDBClient, table_name: str, plan: QueryPlan, values: Mapping[str, Any]
+) -> Iterator[dict[str, dict[str, Any]]]:
+    """
+    Lazily query a table, only requesting the next page once the current one is exhausted.
+
+    :param client: DynamoDB client
+    :param table_name: Name of the table to query
+    :param plan: Query to make
+    :param values: Values the query refers to, including the partition key
+    :return: Items found, in the DDB format
+    """
+    request = plan.get_request(table_name, values)
+    while True:
+        res = client.query(**request)
+        yield from res.get("Items", [])
+        if "LastEvaluatedKey" not in res:
+            return
+        request["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def query_table_page(
+    client: DynamoDBClient,
+    table_name: str,
+    plan: QueryPlan,
+    values: Mapping[str, Any],
+    *,
+    key_types: Mapping[str, type],
+    limit: int,
+    next_token: Optional[str] = None,
+) -> tuple[list[dict[str, dict[str, Any]]], Optional[str]]:
+    """
+    Query a single page of a table.
+
+    :param client: DynamoDB client
+    :param table_name: Name of the table to query
+    :param plan: Query to make
+    :param values: Values the query refers to, including the partition key
+    :param key_types: Types of the key attributes other than the partition key, including those of
+                      the index if the plan queries one, by name
+    :param limit: Maximum number of items to evaluate
+    :param next_token: Token returned by a previous call, to continue where it left off
+    :return: (Items in the page in the DDB format, Token for the next page if there are more items)
+    """
+    key = (plan.key_name, values[plan.key_name])
+    kwargs = (
+        {"ExclusiveStartKey": serialize_item(decode_page_token(next_token, key, key_types))}
+        if next_token
+        else {}
+    )
+    res = client.query(**plan.get_request(table_name, values, Limit=limit, **kwargs))
+
+    last_key = res.get("LastEvaluatedKey")
+    return (
+        res.get("Items", []),
+        encode_page_token(deserialize_item(last_key), key) if last_key else None,
+    )
+
+
+def decode_item(model: type[M], item: dict[str, Any]) -> M:
+    """
+    Build a model from an item read from one of our tables without validating it, since it was
+    validated on the way in. Numbers and sets are converted the way validation would convert them.
+
+    :param model: Model the item was written from
+    :param item: Item in the DDB format
+    :return: Model with the fields present in the item set
+    """
+    return model.construct(
+        **{name: deserialize_field(item[name]) for name in model.__fields__ if name in item}
+    )
+
+
+def encode_page_token(last_key: dict[str, Any], key: tuple[str, Union[int, str]]) -> str:
+    """
+    Encode a LastEvaluatedKey into an opaque token, leaving out the partition key.
+    """
+    last_key = {k: v for k, v in last_key.items() if k != key[0]}
+    return urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_page_token(
+    token: str, key: tuple[str, Union[int, str]], key_types: Mapping[str, type]
+) -> dict[str, Any]:
+    """
+    Decode a token from `encode_page_token` back into an ExclusiveStartKey for the partition,
+    checking that it only holds the other key attributes with values of their types, since
+    tokens come from clients.
+    """
+    try:
+        last_key = json.loads(urlsafe_b64decode(token.encode()))
+    except (BinasciiError, UnicodeError, ValueError):
+        raise AssertionError(f"Invalid page token {token}.")
+    if (
+        not isinstance(last_key, dict)
+        or last_key.keys() != key_types.keys()
+        # Checked exactly, as booleans are ints
+        or any(type(value) is not key_types[name] for name, value in last_key.items())
+    ):
+        raise AssertionError(f"Invalid page token {token}.")
+
+    return {**last_key, key[0]: key[1]}
 
 
 # noinspection PyUnusedLocal
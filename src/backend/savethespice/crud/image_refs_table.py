@@ -0,0 +1,181 @@
+import os
+from typing import Optional
+
+from boto3.dynamodb.conditions import Attr
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+
+from savethespice.crud.common import (
+    format_query_fields,
+    get_client,
+    get_item_from_table,
+    put_item_in_table,
+    update_item_in_table,
+)
+from savethespice.lib.common import root_logger
+
+logging = root_logger.getChild(__name__)
+
+
+_DELETIONS_PROJECTION = format_query_fields(["released", "deletions"])
+
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["image_refs_table_name"], get_client()
+
+
+def acquire(image_key: str, *, legacy: bool = False) -> Optional[dict[str, str]]:
+    """
+    Add a reference to a stored image.
+
+    :param image_key: Key of the image in the images bucket
+    :param legacy: Whether the image is in the bucket but was stored before references were
+                   counted, so that it's counted with the reference it already has
+    :return: Resized variants of the image by name, or None if the image isn't stored yet
+    """
+    table, client = _get_table()
+    kwargs = format_query_fields(
+        {"refCount": 2 if legacy else 1},
+        projection_expression=False,
+        attribute_names=True,
+        attribute_values=True,
+    )
+
+    if legacy:
+        update_expression = "SET #refCount = :refCount"
+        # Entries are kept once released, so that an image being deleted isn't taken for one
+        # stored before references were counted
+        kwargs["ConditionExpression"] = Attr("imageKey").not_exists()
+    else:
+        update_expression = "ADD #refCount :refCount"
+        # Entries only have references while their image is stored
+        kwargs["ConditionExpression"] = Attr("refCount").gt(0)
+
+    try:
+        item = update_item_in_table(
+            client,
+            table,
+            key={"imageKey": image_key},
+            UpdateExpression=update_expression,
+            ReturnValues="ALL_NEW",
+            **kwargs,
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return None
+
+    return item.get("variants", {})
+
+
+def get_deletions(image_key: str) -> Optional[int]:
+    """
+    Get the number of times an image was deleted, to store it again with `create`.
+
+    :param image_key: Key of the image in the images bucket
+    :return: Number of times the image was deleted, or None if it's being deleted
+    """
+    table, client = _get_table()
+    item = get_item_from_table(client, table, key={"imageKey": image_key}, **_DELETIONS_PROJECTION)
+    if item.get("released", {}).get("BOOL", False):
+        return None
+
+    return int(item.get("deletions", {}).get("N", 0))
+
+
+def create(image_key: str, variants: dict[str, str], deletions: int) -> bool:
+    """
+    Add the first reference to an image once it and its resized variants have been stored.
+
+    :param image_key: Key of the image in the images bucket
+    :param variants: Resized variants of the image by name
+    :param deletions: Number of times the image was deleted before it was stored, from
+                      `get_deletions`, so that an image deleted in the meantime isn't referenced
+    :return: Whether the reference was added, rather than the image having been stored or
+             deleted by another request in the meantime
+    """
+    table, client = _get_table()
+    item = {"imageKey": image_key, "refCount": 1, "variants": variants}
+    if deletions:
+        item["deletions"] = deletions
+    try:
+        put_item_in_table(
+            client,
+            table,
+            item=item,
+            ConditionExpression=(
+                Attr("imageKey").not_exists()
+                if not deletions
+                else Attr("deletions").eq(deletions)
+                & Attr("refCount").lte(0)
+                & Attr("released").not_exists()
+            ),
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+    return True
+
+
+def release(image_key: str) -> bool:
+    """
+    Remove a reference to a stored image, marking the image as released once nothing references
+    it. Released images can't be referenced again until they're deleted with `set_deleted`.
+
+    Images stored before references were counted have no entry, and are treated as having a
+    single reference.
+
+    :param image_key: Key of the image in the images bucket
+    :return: Whether the image is no longer referenced and can be deleted
+    """
+    table, client = _get_table()
+    kwargs = format_query_fields(
+        {"refCount": -1}, projection_expression=False, attribute_names=True, attribute_values=True
+    )
+
+    ref_count = update_item_in_table(
+        client,
+        table,
+        key={"imageKey": image_key},
+        UpdateExpression="ADD #refCount :refCount",
+        ReturnValues="UPDATED_NEW",
+        **kwargs,
+    ).get("refCount", 0)
+    if ref_count > 0:
+        return False
+
+    kwargs = format_query_fields(
+        {"released": True}, projection_expression=False, attribute_names=True, attribute_values=True
+    )
+    try:
+        update_item_in_table(
+            client,
+            table,
+            key={"imageKey": image_key},
+            UpdateExpression="SET #released = :released",
+            # Referenced again in the meantime, or released by another request
+            ConditionExpression=Attr("refCount").lte(0) & Attr("released").not_exists(),
+            **kwargs,
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+    return True
+
+
+def set_deleted(image_key: str) -> None:
+    """
+    Mark a released image as deleted from the images bucket, so that it can be stored again.
+    The entry is kept, so that the image isn't taken for one stored before references were
+    counted.
+    """
+    table, client = _get_table()
+    kwargs = format_query_fields(
+        {"deletions": 1}, projection_expression=False, attribute_names=True, attribute_values=True
+    )
+    kwargs["ExpressionAttributeNames"]["#released"] = "released"
+
+    update_item_in_table(
+        client,
+        table,
+        key={"imageKey": image_key},
+        UpdateExpression="REMOVE #released ADD #deletions :deletions",
+        **kwargs,
+    )
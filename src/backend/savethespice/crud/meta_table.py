@@ -1,36 +1,136 @@
 import os
-from functools import cache
-from typing import Literal
+from datetime import datetime, timezone
+from typing import Literal, Optional
 
-import boto3
 from boto3.dynamodb.conditions import Attr
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient, Table
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
 
-from savethespice.crud.common import format_query_fields, get_item_from_table, upsert_to_table
+from savethespice.crud.codec import deserialize_item
+from savethespice.crud.common import (
+    format_query_fields,
+    get_client,
+    get_edit_time,
+    get_item_from_table,
+    update_item_in_table,
+    upsert_to_table,
+)
 from savethespice.lib.common import root_logger
 from savethespice.models import ShoppingList
 
 logging = root_logger.getChild(__name__)
 
+# Marker for collections that haven't been modified since markers were kept
+UNMODIFIED_VERSION = 0
+UNMODIFIED_TIME = datetime.fromtimestamp(0, tz=timezone.utc).isoformat()
 
-@cache
-def _get_table() -> tuple[Table, DynamoDBClient]:
-    client: DynamoDBClient = boto3.client("dynamodb")
-    table = boto3.resource("dynamodb").Table(os.environ["meta_table_name"])
+_CATEGORY_INDEX_STATE_PROJECTION = format_query_fields(
+    ["categoryIndexBuilt", "categoryIndexInvalidations"]
+)
+_SHOPPING_LIST_PROJECTION = format_query_fields(["shoppingList"])
+_LAST_MODIFIED_PROJECTIONS = {
+    type_: format_query_fields([f"{type_}Version", f"{type_}LastModified"])
+    for type_ in ("recipes", "categories")
+}
 
-    return table, client
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["meta_table_name"], get_client()
 
 
 def create_user(user_id: str) -> None:
-    table, _ = _get_table()
-    upsert_to_table(table, key={"userId": user_id})
+    table, client = _get_table()
+    upsert_to_table(client, table, key={"userId": user_id})
+    # New users have no recipes to index
+    set_category_index_built(user_id)
+
+
+def get_category_index_state(user_id: str) -> tuple[bool, int]:
+    """
+    Check whether the recipes in each category are tracked for the user, which is only the case
+    for users whose recipes have all been written or indexed since the index was introduced, and
+    haven't had an index update fail since.
+
+    :param user_id: ID of the user
+    :return: (Whether the index is built, Number of times the index was invalidated)
+    """
+    table, client = _get_table()
+    item = get_item_from_table(
+        client, table, key={"userId": user_id}, **_CATEGORY_INDEX_STATE_PROJECTION
+    )
+
+    return (
+        item.get("categoryIndexBuilt", {}).get("BOOL", False),
+        int(item.get("categoryIndexInvalidations", {}).get("N", 0)),
+    )
+
+
+def set_category_index_built(user_id: str, invalidations: Optional[int] = None) -> bool:
+    """
+    Mark the category index as built for the user.
+
+    :param user_id: ID of the user
+    :param invalidations: Number of times the index was invalidated when it started being built,
+                          so that it isn't marked as built if an update failed in the meantime
+    :return: Whether the index was marked as built
+    """
+    table, client = _get_table()
+    kwargs = format_query_fields(
+        {"categoryIndexBuilt": True},
+        projection_expression=False,
+        attribute_names=True,
+        attribute_values=True,
+    )
+    if invalidations is not None:
+        kwargs["ConditionExpression"] = (
+            Attr("categoryIndexInvalidations").not_exists()
+            if not invalidations
+            else Attr("categoryIndexInvalidations").eq(invalidations)
+        )
+
+    try:
+        update_item_in_table(
+            client,
+            table,
+            key={"userId": user_id},
+            UpdateExpression="SET #categoryIndexBuilt = :categoryIndexBuilt",
+            **kwargs,
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+    return True
+
+
+def invalidate_category_index(user_id: str) -> None:
+    """
+    Mark the category index as needing to be rebuilt for the user, after an update to it failed.
+    """
+    table, client = _get_table()
+    kwargs = format_query_fields(
+        {"categoryIndexBuilt": False, "categoryIndexInvalidations": 1},
+        projection_expression=False,
+        attribute_names=True,
+        attribute_values=True,
+    )
+
+    update_item_in_table(
+        client,
+        table,
+        key={"userId": user_id},
+        UpdateExpression=(
+            "SET #categoryIndexBuilt = :categoryIndexBuilt "
+            "ADD #categoryIndexInvalidations :categoryIndexInvalidations"
+        ),
+        **kwargs,
+    )
 
 
 def get_shopping_list(user_id: str) -> ShoppingList:
-    table, _ = _get_table()
-    kwargs = format_query_fields(["shoppingList"])
+    table, client = _get_table()
+
+    item = get_item_from_table(client, table, key={"userId": user_id}, **_SHOPPING_LIST_PROJECTION)
 
-    return get_item_from_table(table, key={"userId": user_id}, **kwargs).get("shoppingList", [])
+    return deserialize_item(item).get("shoppingList", [])
 
 
 def update_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
@@ -43,6 +143,7 @@ def update_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
     )
     try:
         upsert_to_table(
+            client,
             table,
             key={"userId": user_id},
             UpdateExpression="SET #shoppingList = list_append(#shoppingList, :shoppingList)",
@@ -51,6 +152,7 @@ def update_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
         )
     except client.exceptions.ConditionalCheckFailedException:
         upsert_to_table(
+            client,
             table,
             key={"userId": user_id},
             UpdateExpression="SET #shoppingList = :shoppingList",
@@ -60,7 +162,7 @@ def update_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
 
 
 def overwrite_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
-    table, _ = _get_table()
+    table, client = _get_table()
     kwargs = format_query_fields(
         {"shoppingList": shopping_list},
         projection_expression=False,
@@ -68,6 +170,7 @@ def overwrite_shopping_list(user_id: str, shopping_list: ShoppingList) -> None:
         attribute_values=True,
     )
     upsert_to_table(
+        client,
         table,
         key={"userId": user_id},
         UpdateExpression="SET #shoppingList = :shoppingList",
@@ -84,24 +187,87 @@ def get_next_id(user_id: str, type_: Literal["recipe", "category"]) -> int:
     :param type_: Type of ID to get; one of recipe or category
     :return: The next sequential ID for the
     """
-    table, _ = _get_table()
+    return get_next_ids(user_id, type_, 1).start
+
+
+def get_next_ids(user_id: str, type_: Literal["recipe", "category"], count: int) -> range:
+    """
+    Reserve a contiguous block of recipe or category IDs in a single update.
+
+    :param user_id: ID of the user
+    :param type_: Type of ID to get; one of recipe or category
+    :param count: Number of IDs to reserve
+    :return: The reserved IDs
+    """
+    table, client = _get_table()
     field_name = f"next{type_.title()}Id"
     kwargs = format_query_fields(
-        {field_name: 1},
+        {field_name: count},
         projection_expression=False,
         attribute_names=True,
         attribute_values=True,
     )
 
-    next_id = (
-        table.update_item(
-            Key={"userId": user_id},
-            UpdateExpression=f"ADD #{field_name} :{field_name}",
-            ReturnValues="UPDATED_OLD",
-            **kwargs,
-        )
-        .get("Attributes", {})
-        .get(field_name, 0)
+    next_id = update_item_in_table(
+        client,
+        table,
+        key={"userId": user_id},
+        UpdateExpression=f"ADD #{field_name} :{field_name}",
+        ReturnValues="UPDATED_OLD",
+        **kwargs,
+    ).get(field_name, 0)
+
+    return range(next_id, next_id + count)
+
+
+def get_last_modified(user_id: str, type_: Literal["recipes", "categories"]) -> tuple[int, str]:
+    """
+    Get the marker for the last change to a user's recipes or categories, so that clients can be
+    told whether their copy is stale without reading the whole collection.
+
+    :param user_id: ID of the user
+    :param type_: Collection to get the marker for; one of recipes or categories
+    :return: (Version of the collection, Time it was last modified), or `UNMODIFIED_VERSION` and
+             `UNMODIFIED_TIME` if it hasn't been modified since markers were kept
+    """
+    table, client = _get_table()
+
+    item = get_item_from_table(
+        client, table, key={"userId": user_id}, **_LAST_MODIFIED_PROJECTIONS[type_]
+    )
+    if f"{type_}Version" not in item:
+        # Collections last changed before markers were kept, which get one on their next change
+        return UNMODIFIED_VERSION, UNMODIFIED_TIME
+
+    return int(item[f"{type_}Version"]["N"]), item[f"{type_}LastModified"]["S"]
+
+
+def set_last_modified(user_id: str, type_: Literal["recipes", "categories"]) -> tuple[int, str]:
+    """
+    Mark a user's recipes or categories as modified.
+
+    :param user_id: ID of the user
+    :param type_: Collection that was modified; one of recipes or categories
+    :return: (New version of the collection, Time it was last modified)
+    """
+    table, client = _get_table()
+    edit_time = get_edit_time()
+    kwargs = format_query_fields(
+        {f"{type_}Version": 1, f"{type_}LastModified": edit_time},
+        projection_expression=False,
+        attribute_names=True,
+        attribute_values=True,
     )
 
-    return next_id
+    version = update_item_in_table(
+        client,
+        table,
+        key={"userId": user_id},
+        UpdateExpression=(
+            f"ADD #{type_}Version :{type_}Version SET #{type_}LastModified = :{type_}LastModified"
+        ),
+        ReturnValues="UPDATED_NEW",
+        **kwargs,
+    )[f"{type_}Version"]
+
+    return version, edit_time
@@ -0,0 +1,76 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+
+from savethespice.crud.common import (
+    QueryPlan,
+    batch_write_to_table,
+    get_client,
+    get_edit_time,
+    iter_query_table,
+)
+from savethespice.lib.common import root_logger
+
+# How long clients have to sync after a recipe is deleted before they need a full resync
+RECIPE_TOMBSTONE_TTL = timedelta(days=30)
+logging = root_logger.getChild(__name__)
+
+_DELETED_SINCE_QUERY = QueryPlan(
+    "userId",
+    ["recipeId"],
+    filter_expression="#deleteTime >= :deleteTime",
+    attribute_names=["deleteTime"],
+)
+
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["recipe_tombstones_table_name"], get_client()
+
+
+def get_deleted_since(user_id: str, since: str) -> list[int]:
+    """
+    Get the IDs of recipes deleted at or after a time.
+
+    :param user_id: ID of the user
+    :param since: Time in ISO format, no older than `RECIPE_TOMBSTONE_TTL`
+    :return: IDs of the deleted recipes
+    """
+    table, client = _get_table()
+
+    return [
+        int(item["recipeId"]["N"])
+        for item in iter_query_table(
+            client, table, _DELETED_SINCE_QUERY, {"userId": user_id, "deleteTime": since}
+        )
+    ]
+
+
+def put_many(user_id: str, recipe_ids: Iterable[int]) -> None:
+    """
+    Record that recipes were deleted, for clients syncing changes.
+    """
+    table, client = _get_table()
+    delete_time = get_edit_time()
+    ttl = int((datetime.now(tz=timezone.utc) + RECIPE_TOMBSTONE_TTL).timestamp())
+
+    failed_requests = batch_write_to_table(
+        client,
+        table,
+        requests=[
+            {
+                "PutRequest": {
+                    "Item": {
+                        "userId": user_id,
+                        "recipeId": recipe_id,
+                        "deleteTime": delete_time,
+                        "ttl": ttl,
+                    }
+                }
+            }
+            for recipe_id in recipe_ids
+        ],
+    )
+    if failed_requests:
+        logging.error(f"Failed to record deleted recipes: {failed_requests}")
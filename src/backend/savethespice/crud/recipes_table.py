@@ -1,158 +1,440 @@
 import os
-from collections import Generator, Iterable
+from collections import Generator, Iterable, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import cache
-from typing import Optional
+from typing import Any, Optional
 
-import boto3
 from boto3.dynamodb.conditions import Attr
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient, Table
-from botocore.exceptions import ClientError
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
 
+from savethespice.crud import recipe_tombstones_table
+from savethespice.crud.codec import deserialize_item
 from savethespice.crud.common import (
+    QueryPlan,
+    UnprocessedKeysError,
+    batch_write_to_table,
+    decode_item,
     format_query_fields,
+    get_client,
+    get_edit_time,
     get_item_from_table,
-    query_table,
+    get_items_from_table,
+    iter_query_table,
+    query_table_page,
     remove_item_from_table,
+    transact_write_to_table,
     upsert_to_table,
 )
+from savethespice.crud.meta_table import set_last_modified
 from savethespice.lib.common import chunks, root_logger
-from savethespice.models import Recipe, RecipeBase
+from savethespice.models import PartialRecipe, Recipe, RecipeBase
 
 logging = root_logger.getChild(__name__)
 
+# Global secondary index keyed on (userId, updateTime)
+RECIPE_UPDATE_TIME_INDEX = "userId-updateTime-index"
+RECIPE_TRANSACTION_CONCURRENCY = 4
+
+RECIPE_FIELDS = [
+    "recipeId",
+    "name",
+    "desc",
+    "url",
+    "adaptedFrom",
+    "cookTime",
+    "yields",
+    "categories",
+    "instructions",
+    "ingredients",
+    "imgSrc",
+    "imgVariants",
+    "updateTime",
+    "createTime",
+]
+# Named sets of fields that can be asked for instead of listing them
+RECIPE_FIELD_PRESETS = {
+    "summary": ["recipeId", "name", "imgSrc", "imgVariants", "categories", "updateTime"],
+}
+
+
+_RECIPE_PROJECTION = format_query_fields(
+    [
+        "recipeId",
+        "name",
+        "desc",
+        "url",
+        "adaptedFrom",
+        "cookTime",
+        "yields",
+        "instructions",
+        "ingredients",
+        "imgSrc",
+        "imgVariants",
+        "updateTime",
+        "createTime",
+    ],
+)
+_IMAGE_AND_CATEGORIES_PROJECTION = format_query_fields(["imgSrc", "imgVariants", "categories"])
+_DELETED_RECIPE_PROJECTION = format_query_fields(["recipeId", "imgSrc", "categories"])
+_CATEGORY_INDEX_QUERY = QueryPlan("userId", ["recipeId", "categories"])
+_CHANGED_SINCE_QUERY = QueryPlan(
+    "userId",
+    index_name=RECIPE_UPDATE_TIME_INDEX,
+    key_condition="#updateTime >= :updateTime",
+    attribute_names=["updateTime"],
+)
+
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["recipes_table_name"], get_client()
+
 
 @cache
-def _get_table() -> tuple[Table, DynamoDBClient]:
-    client: DynamoDBClient = boto3.client("dynamodb")
-    table = boto3.resource("dynamodb").Table(os.environ["recipes_table_name"])
+def _get_projection(fields: Optional[tuple[str, ...]]) -> dict[str, Any]:
+    return format_query_fields(list(fields or RECIPE_FIELDS))
+
 
-    return table, client
+@cache
+def _get_query_plan(fields: Optional[tuple[str, ...]]) -> QueryPlan:
+    return QueryPlan("userId", fields or RECIPE_FIELDS)
 
 
 def get(user_id: str, recipe_id: int) -> Optional[Recipe]:
-    table, _ = _get_table()
-    kwargs = format_query_fields(
-        [
-            "recipeId",
-            "name",
-            "desc",
-            "url",
-            "adaptedFrom",
-            "cookTime",
-            "yields",
-            "instructions",
-            "ingredients",
-            "imgSrc",
-            "updateTime",
-            "createTime",
-        ],
+    table, client = _get_table()
+    item = get_item_from_table(
+        client, table, key={"userId": user_id, "recipeId": recipe_id}, **_RECIPE_PROJECTION
     )
-    item = get_item_from_table(table, key={"userId": user_id, "recipeId": recipe_id}, **kwargs)
 
-    return Recipe(**item) if item else None
+    return decode_item(Recipe, item) if item else None
 
 
-def get_all(user_id: str) -> Generator[Recipe, None, None]:
-    kwargs = format_query_fields(
-        [
-            "recipeId",
-            "name",
-            "desc",
-            "url",
-            "adaptedFrom",
-            "cookTime",
-            "yields",
-            "categories",
-            "instructions",
-            "ingredients",
-            "imgSrc",
-            "updateTime",
-            "createTime",
-        ],
+def get_many(
+    user_id: str, recipe_ids: Iterable[int], fields: Optional[list[str]] = None
+) -> list[Recipe]:
+    """
+    Get recipes by ID.
+
+    :param user_id: ID of the user
+    :param recipe_ids: IDs of the recipes
+    :param fields: Fields to get, including `recipeId`, or None for all of them
+    :return: Recipes that exist, in the order of `recipe_ids`
+    :raises UnprocessedKeysError: If some of the recipes couldn't be read
+    """
+    table, client = _get_table()
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+
+    items, unprocessed_keys = get_items_from_table(
+        client,
+        table,
+        keys=[{"userId": user_id, "recipeId": recipe_id} for recipe_id in recipe_ids],
+        **_get_projection(fields and tuple(fields)),
+    )
+    if unprocessed_keys:
+        raise UnprocessedKeysError(unprocessed_keys)
+    recipes = {recipe.recipeId: recipe for recipe in (_to_recipe(item, fields) for item in items)}
+
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+def get_changed_since(user_id: str, since: str, fields: Optional[list[str]] = None) -> list[Recipe]:
+    """
+    Get recipes created or updated at or after a time.
+
+    :param user_id: ID of the user
+    :param since: Time in ISO format
+    :param fields: Fields to get, including `recipeId`, or None for all of them
+    :return: Changed recipes
+    :raises UnprocessedKeysError: If some of the recipes couldn't be read
+    """
+    table, client = _get_table()
+
+    return get_many(
+        user_id,
+        (
+            int(item["recipeId"]["N"])
+            for item in iter_query_table(
+                client, table, _CHANGED_SINCE_QUERY, {"userId": user_id, "updateTime": since}
+            )
+        ),
+        fields,
+    )
+
+
+def get_image_and_categories(
+    user_id: str, recipe_id: int
+) -> tuple[Optional[str], dict[str, str], set[int]]:
+    """
+    Get the image and categories of a recipe.
+
+    :param user_id: ID of the user
+    :param recipe_id: ID of the recipe
+    :return: (Image source, Resized variants of the image by name, Category IDs)
+    """
+    table, client = _get_table()
+
+    item = deserialize_item(
+        get_item_from_table(
+            client,
+            table,
+            key={"userId": user_id, "recipeId": recipe_id},
+            **_IMAGE_AND_CATEGORIES_PROJECTION,
+        )
+    )
+
+    return item.get("imgSrc"), item.get("imgVariants", {}), item.get("categories", set())
+
+
+def get_category_index(user_id: str) -> dict[int, set[int]]:
+    """
+    Read every recipe to find the recipes in each category.
+
+    :param user_id: ID of the user
+    :return: IDs of the recipes in each category, by category ID
+    """
+    table, client = _get_table()
+
+    category_index: dict[int, set[int]] = defaultdict(set)
+    for recipe in iter_query_table(client, table, _CATEGORY_INDEX_QUERY, {"userId": user_id}):
+        for category_id in recipe.get("categories", {}).get("NS", []):
+            category_index[int(category_id)].add(int(recipe["recipeId"]["N"]))
+
+    return category_index
+
+
+def get_all(user_id: str, fields: Optional[list[str]] = None) -> Generator[Recipe, None, None]:
+    table, client = _get_table()
+    plan = _get_query_plan(fields and tuple(fields))
+
+    return (
+        _to_recipe(r, fields) for r in iter_query_table(client, table, plan, {"userId": user_id})
     )
 
-    # TODO: Paginate
-    table, _ = _get_table()
 
-    return (Recipe(**r) for r in query_table(table, key=("userId", user_id), **kwargs))
+def get_page(
+    user_id: str,
+    limit: int,
+    next_token: Optional[str] = None,
+    fields: Optional[list[str]] = None,
+) -> tuple[list[Recipe], Optional[str]]:
+    """
+    Get a single page of recipes.
+
+    :param user_id: ID of the user
+    :param limit: Maximum number of recipes to return
+    :param next_token: Token from a previous page, if continuing
+    :param fields: Fields to get, including `recipeId`, or None for all of them
+    :return: (Recipes in the page, Token for the next page if there are more recipes)
+    """
+    table, client = _get_table()
+
+    items, next_token = query_table_page(
+        client,
+        table,
+        _get_query_plan(fields and tuple(fields)),
+        {"userId": user_id},
+        key_types={"recipeId": int},
+        limit=limit,
+        next_token=next_token,
+    )
+
+    return [_to_recipe(r, fields) for r in items], next_token
 
 
 def upsert(user_id: str, recipe_id: int, body: RecipeBase) -> Recipe:
-    table, _ = _get_table()
+    table, client = _get_table()
     if body.categories:
         body.categories = set(body.categories)
     create_time, update_time = upsert_to_table(
-        table, key={"userId": user_id, "recipeId": recipe_id}, item=body
+        client, table, key={"userId": user_id, "recipeId": recipe_id}, item=body
     )
+    set_last_modified(user_id, "recipes")
 
     return Recipe(**body.dict(), recipeId=recipe_id, createTime=create_time, updateTime=update_time)
 
 
-def delete(user_id, recipe_id: int) -> str:
-    table, _ = _get_table()
+def put_many(user_id: str, bodies: dict[int, RecipeBase]) -> tuple[list[Recipe], list[int]]:
+    """
+    Write new recipes in bulk, replacing any existing entries with the same IDs.
 
-    return (
-        remove_item_from_table(
-            table,
-            key={"userId": user_id, "recipeId": recipe_id},
-            ConditionExpression=Attr("userId").exists() & Attr("recipeId").exists(),
-            ReturnValues="ALL_OLD",
+    :param user_id: ID of the user
+    :param bodies: Recipes to write, by recipe ID
+    :return: (Recipes written, IDs of recipes that failed to be written)
+    """
+    table, client = _get_table()
+    edit_time = get_edit_time()
+    items = {
+        recipe_id: {
+            **{k: v for k, v in body.dict().items() if v not in ("", None, [], {})},
+            "userId": user_id,
+            "recipeId": recipe_id,
+            "createTime": edit_time,
+            "updateTime": edit_time,
+        }
+        for recipe_id, body in bodies.items()
+    }
+    for item in items.values():
+        if "categories" in item:
+            item["categories"] = set(item["categories"])
+
+    failed_requests = batch_write_to_table(
+        client, table, requests=[{"PutRequest": {"Item": item}} for item in items.values()]
+    )
+    failed_ids = [request["PutRequest"]["Item"]["recipeId"] for request in failed_requests]
+    if len(failed_ids) < len(items):
+        set_last_modified(user_id, "recipes")
+
+    return [
+        Recipe(**body.dict(), recipeId=recipe_id, createTime=edit_time, updateTime=edit_time)
+        for recipe_id, body in bodies.items()
+        if recipe_id not in failed_ids
+    ], failed_ids
+
+
+def delete(user_id, recipe_id: int) -> tuple[Optional[str], set[int]]:
+    """
+    :return: (Image source of the deleted recipe, Its category IDs)
+    """
+    table, client = _get_table()
+    item = remove_item_from_table(
+        client,
+        table,
+        key={"userId": user_id, "recipeId": recipe_id},
+        ConditionExpression=Attr("userId").exists() & Attr("recipeId").exists(),
+        ReturnValues="ALL_OLD",
+    )
+    recipe_tombstones_table.put_many(user_id, [recipe_id])
+    set_last_modified(user_id, "recipes")
+
+    return item.get("imgSrc"), item.get("categories", set())
+
+
+def delete_many(
+    user_id: str, recipe_ids: Iterable[int]
+) -> tuple[list[str], dict[int, set[int]], list[int]]:
+    """
+    Delete recipes in bulk.
+
+    :param user_id: ID of the user
+    :param recipe_ids: IDs of the recipes to delete
+    :return: (Image sources of the deleted recipes, IDs of the deleted recipes in each category by
+              category ID, IDs of recipes that failed to be deleted)
+    """
+    table, client = _get_table()
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+
+    # Single read for existence, images, and categories, since BatchWriteItem can't be conditional
+    image_sources: dict[int, Optional[str]] = {}
+    categories: dict[int, list[str]] = {}
+    items, unprocessed_keys = get_items_from_table(
+        client,
+        table,
+        keys=[{"userId": user_id, "recipeId": recipe_id} for recipe_id in recipe_ids],
+        **_DELETED_RECIPE_PROJECTION,
+    )
+    for item in items:
+        recipe_id = int(item["recipeId"]["N"])
+        image_sources[recipe_id] = item.get("imgSrc", {}).get("S")
+        categories[recipe_id] = item.get("categories", {}).get("NS", [])
+
+    failed_requests = batch_write_to_table(
+        client,
+        table,
+        requests=[
+            {"DeleteRequest": {"Key": {"userId": user_id, "recipeId": recipe_id}}}
+            for recipe_id in image_sources
+        ],
+    )
+    failed_ids = {request["DeleteRequest"]["Key"]["recipeId"] for request in failed_requests}
+    # Including those that couldn't be read to check that they exist
+    failed_ids.update(key["recipeId"] for key in unprocessed_keys)
+    failed_ids.update(recipe_id for recipe_id in recipe_ids if recipe_id not in image_sources)
+    if len(failed_ids) < len(recipe_ids):
+        recipe_tombstones_table.put_many(
+            user_id, (recipe_id for recipe_id in recipe_ids if recipe_id not in failed_ids)
         )
-        .get("Attributes", {})
-        .get("imgSrc")
+        set_last_modified(user_id, "recipes")
+
+    removed_categories: dict[int, set[int]] = defaultdict(set)
+    for recipe_id, category_ids in categories.items():
+        if recipe_id not in failed_ids:
+            for category_id in category_ids:
+                removed_categories[int(category_id)].add(recipe_id)
+
+    return (
+        [
+            image_source
+            for recipe_id, image_source in image_sources.items()
+            if image_source and recipe_id not in failed_ids
+        ],
+        removed_categories,
+        [recipe_id for recipe_id in recipe_ids if recipe_id in failed_ids],
     )
 
 
-def remove_categories_from_recipes(user_id: str, category_ids: Iterable[int]) -> list[int]:
+def remove_categories_from_recipes(
+    user_id: str, category_ids: Iterable[int], recipe_ids: Iterable[int]
+) -> tuple[list[int], list[int]]:
     """
-    Remove references to the specified categories from all recipes.
+    Remove references to the specified categories from the recipes in them, in parallel
+    transactions of 25 recipes.
 
     :param user_id: ID of the user
     :param category_ids: IDs of the categories to remove
-    :return: IDs for updated recipes
-    """
-    recipes_table, client = _get_table()
-    kwargs = format_query_fields(["recipeId", "categories"])
-    recipes_to_update = [
-        int(recipe["recipeId"])
-        for recipe in query_table(
-            recipes_table,
-            key=("userId", user_id),
-            **kwargs,
-        )
-        # Check if it shares any categories with category_ids. Can't be done with
-        # FilterExpression due to it not supporting checking for multiple items in sets
-        if not set(recipe.get("categories", [])).isdisjoint(category_ids)
-    ]
+    :param recipe_ids: IDs of the recipes in the categories
+    :return: (IDs of updated recipes, IDs of recipes that failed to be updated)
+    """
+    table, client = _get_table()
+    recipes_to_update = sorted(set(recipe_ids))
     if not recipes_to_update:
         logging.info(f"No recipes to update after deleting category IDs {category_ids}")
-        return []
+        return [], []
 
     logging.info(
         f"Removing references to categories with IDs {category_ids} from "
         f"recipes with IDs {recipes_to_update} for user with ID {user_id}."
     )
 
+    update_time = get_edit_time()
     items = [
         {
             "Update": {
-                "TableName": os.environ["recipes_table_name"],
+                "TableName": table,
                 "Key": {"userId": {"S": user_id}, "recipeId": {"N": str(recipe_id)}},
-                "UpdateExpression": "DELETE #categories :categories",
-                "ExpressionAttributeNames": {"#categories": "categories"},
+                "UpdateExpression": (
+                    "DELETE #categories :categories SET #updateTime = :updateTime"
+                ),
+                # Don't recreate recipes deleted in the meantime
+                "ConditionExpression": "attribute_exists(#recipeId)",
+                "ExpressionAttributeNames": {
+                    "#categories": "categories",
+                    "#recipeId": "recipeId",
+                    "#updateTime": "updateTime",
+                },
                 "ExpressionAttributeValues": {
-                    ":categories": {"NS": [str(c) for c in category_ids]}
+                    ":categories": {"NS": [str(c) for c in category_ids]},
+                    ":updateTime": {"S": update_time},
                 },
             }
         }
         for recipe_id in recipes_to_update
     ]
-    try:
-        for chunk in chunks(items, batch_size=25):
-            client.transact_write_items(
-                TransactItems=[item for item in chunk if item]
-            )  # Filter Nones
-    except ClientError as e:
-        logging.info(f"Response: {e.response}")
-
-    return recipes_to_update
+
+    def _transact_write(chunk: tuple[Optional[dict]]) -> tuple[list[dict], list[dict]]:
+        return transact_write_to_table(client, items=[item for item in chunk if item])
+
+    with ThreadPoolExecutor(max_workers=RECIPE_TRANSACTION_CONCURRENCY) as executor:
+        results = list(executor.map(_transact_write, chunks(items, batch_size=25)))
+    if any(written for written, _ in results):
+        set_last_modified(user_id, "recipes")
+
+    def _get_recipe_ids(items_: Iterable[dict]) -> list[int]:
+        return sorted(int(item["Update"]["Key"]["recipeId"]["N"]) for item in items_)
+
+    return (
+        _get_recipe_ids(item for written, _ in results for item in written),
+        _get_recipe_ids(item for _, failed in results for item in failed),
+    )
+
+
+def _to_recipe(item: dict, fields: Optional[list[str]]) -> Recipe:
+    return decode_item(Recipe if fields is None else PartialRecipe, item)
@@ -0,0 +1,67 @@
+import json
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Optional
+
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+from botocore.exceptions import ClientError
+
+from savethespice.crud.codec import deserialize_item
+from savethespice.crud.common import get_client, get_item_from_table, put_item_in_table
+from savethespice.lib.common import root_logger
+
+logging = root_logger.getChild(__name__)
+
+# Stand-in for the table when it isn't configured, e.g. when running locally
+_local_items: dict[str, dict[str, Any]] = {}
+
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["scrape_cache_table_name"], get_client()
+
+
+def get(url: str) -> Optional[dict[str, Any]]:
+    """
+    Get the cached scrape result for a URL, if it hasn't expired.
+
+    :param url: Normalized URL that was scraped
+    :return: Scraped recipe data
+    """
+    if "scrape_cache_table_name" not in os.environ:
+        item = _local_items.get(url)
+    else:
+        table, client = _get_table()
+        try:
+            item = deserialize_item(get_item_from_table(client, table, key={"url": url}))
+        except ClientError:
+            logging.exception(f"Failed to read cached scrape of {url}")
+            return None
+
+    # Expired items can linger until DynamoDB gets around to removing them
+    if not item or item["ttl"] <= datetime.now(tz=timezone.utc).timestamp():
+        return None
+
+    return item["data"]
+
+
+def put(url: str, data: dict[str, Any], ttl: int) -> None:
+    """
+    Cache the scrape result for a URL.
+
+    :param url: Normalized URL that was scraped
+    :param data: Scraped recipe data
+    :param ttl: Epoch time in seconds at which the entry expires
+    """
+    item = {"url": url, "data": data, "ttl": ttl}
+    if "scrape_cache_table_name" not in os.environ:
+        _local_items[url] = item
+        return
+
+    table, client = _get_table()
+    try:
+        # The codec only stores numbers as ints or Decimals, and scraped times can be floats
+        item["data"] = json.loads(json.dumps(data), parse_float=Decimal)
+        put_item_in_table(client, table, item=item)
+    except (ClientError, TypeError, ValueError):
+        logging.exception(f"Failed to cache scrape of {url}")
@@ -1,11 +1,15 @@
 import os
-from functools import cache
 from typing import Optional
 
-import boto3
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient, Table
+from boto3_type_annotations.dynamodb import Client as DynamoDBClient
 
-from savethespice.crud.common import format_query_fields, get_item_from_table, upsert_to_table
+from savethespice.crud.common import (
+    decode_item,
+    format_query_fields,
+    get_client,
+    get_item_from_table,
+    upsert_to_table,
+)
 from savethespice.lib.common import root_logger
 from savethespice.models import PostRecipeRequest, RecipeBase, ShareRecipeEntry
 from savethespice.models.requests.share import ShareRecipeBase
@@ -13,42 +17,42 @@ from savethespice.models.requests.share import ShareRecipeBase
 logging = root_logger.getChild(__name__)
 
 
-@cache
-def _get_table() -> tuple[Table, DynamoDBClient]:
-    client: DynamoDBClient = boto3.client("dynamodb")
-    table = boto3.resource("dynamodb").Table(os.environ["share_table_name"])
+_SHARE_PROJECTION = format_query_fields(
+    [
+        "shareId",
+        "name",
+        "desc",
+        "url",
+        "adaptedFrom",
+        "cookTime",
+        "yields",
+        "categories",
+        "instructions",
+        "ingredients",
+        "imgSrc",
+        "imgVariants",
+    ]
+)
 
-    return table, client
+
+def _get_table() -> tuple[str, DynamoDBClient]:
+    return os.environ["share_table_name"], get_client()
 
 
 def get(share_id: str) -> Optional[PostRecipeRequest]:
-    table, _ = _get_table()
-    kwargs = format_query_fields(
-        [
-            "shareId",
-            "name",
-            "desc",
-            "url",
-            "adaptedFrom",
-            "cookTime",
-            "yields",
-            "categories",
-            "instructions",
-            "ingredients",
-            "imgSrc",
-        ]
-    )
+    table, client = _get_table()
 
-    item = get_item_from_table(table, key={"shareId": share_id}, **kwargs)
+    item = get_item_from_table(client, table, key={"shareId": share_id}, **_SHARE_PROJECTION)
 
-    return PostRecipeRequest(**item) if item else None
+    return decode_item(PostRecipeRequest, item) if item else None
 
 
 def upsert(share_id: str, body: RecipeBase, ttl: int) -> ShareRecipeEntry:
-    table, _ = _get_table()
+    table, client = _get_table()
     if body.categories:
         body.categories = set(body.categories)
     create_time, update_time = upsert_to_table(
+        client,
         table,
         key={"shareId": share_id},
         item=ShareRecipeBase(**body.dict(), ttl=ttl),
@@ -1,9 +1,12 @@
 import logging
-from collections import Iterable, Iterator
+import random
+from collections import Iterable, Iterator, OrderedDict
 from itertools import zip_longest
 from logging.config import dictConfig
 from pprint import pformat as pformat_
-from typing import TypeVar
+from threading import Lock
+from time import monotonic
+from typing import Generic, Optional, TypeVar
 
 from savethespice.lib.config import logging_config
 
@@ -11,6 +14,8 @@ dictConfig(logging_config)
 root_logger = logging.getLogger("SaveTheSpice")
 root_logger.setLevel(logging.INFO)
 
+MAX_PAGE_SIZE = 1000
+
 # jwks = requests.get(
 #     f"https://cognito-idp.{os.environ['AWS_REGION']}.amazonaws.com"
 #     f"/{USER_POOL_ID}/.well-known/jwks.json"
@@ -31,6 +36,7 @@ def pformat(obj: object) -> str:
 
 
 T = TypeVar("T")
+K = TypeVar("K")
 
 
 def chunks(iterable: Iterable[T], batch_size: int = 10) -> Iterator[T]:
@@ -38,3 +44,40 @@ def chunks(iterable: Iterable[T], batch_size: int = 10) -> Iterator[T]:
     Break an iterable up into chunks of `batch_size` size.
     """
     return zip_longest(*[iter(iterable)] * batch_size)
+
+
+def jittered_backoff(attempt: int, base: float = 0.05, cap: float = 2.0) -> float:
+    """
+    Get a randomized delay in seconds for the given retry attempt, growing exponentially.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class TTLCache(Generic[K, T]):
+    """
+    Thread-safe in-memory LRU cache, with entries expiring `ttl` seconds after being set.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, T]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: K) -> Optional[T]:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            expiry, value = entry
+            if expiry <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: T) -> None:
+        with self._lock:
+            self._entries[key] = (monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,75 @@
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import sha256
+from typing import Any, Optional
+
+from fastapi import Request, Response, status
+
+
+def get_etag(*parts: Any) -> str:
+    """
+    Get a weak entity tag identifying a representation built from `parts`.
+    """
+    digest = sha256(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def get_not_modified_response(
+    req: Request, etag: str, last_modified: Optional[str] = None
+) -> Optional[Response]:
+    """
+    Get a 304 response if the client's copy is still current, going by If-None-Match, or by
+    If-Modified-Since when no entity tags are sent. Edit times only have second precision, so
+    If-Modified-Since is only honored once the second of the last modification is over.
+
+    :param req: Request, possibly conditional
+    :param etag: Entity tag of the current representation
+    :param last_modified: Time the current representation was last modified, in ISO format
+    :return: 304 response if the client's copy is current, otherwise None
+    """
+    if (if_none_match := req.headers.get("If-None-Match")) is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        not_modified = "*" in tags or etag.removeprefix("W/") in tags
+    elif (
+        last_modified
+        and _is_settled(modified := _parse_time(last_modified))
+        and (if_modified_since := req.headers.get("If-Modified-Since"))
+    ):
+        try:
+            not_modified = parsedate_to_datetime(if_modified_since) >= modified
+        except (TypeError, ValueError):
+            not_modified = False
+    else:
+        not_modified = False
+
+    if not not_modified:
+        return None
+
+    res = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    set_validators(res, etag, last_modified)
+    return res
+
+
+def set_validators(res: Response, etag: str, last_modified: Optional[str] = None) -> None:
+    """
+    Set the ETag and Last-Modified headers, asking clients to revalidate before reusing a copy.
+    Last-Modified is left out while more changes could still happen in the same second, and
+    responses vary by user.
+    """
+    res.headers["ETag"] = etag
+    if last_modified and _is_settled(modified := _parse_time(last_modified)):
+        res.headers["Last-Modified"] = format_datetime(modified, usegmt=True)
+    res.headers["Cache-Control"] = "private, no-cache"
+    res.headers.add_vary_header("Authorization")
+
+
+def _is_settled(modified: datetime) -> bool:
+    """
+    Whether a modification time is before the current second, so no later change can share it.
+    """
+    return modified < datetime.now(tz=timezone.utc).replace(microsecond=0)
+
+
+def _parse_time(time: str) -> datetime:
+    return datetime.fromisoformat(time).astimezone(timezone.utc)
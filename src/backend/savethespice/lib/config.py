@@ -1,3 +1,5 @@
+import sys
+
 from pydantic import BaseSettings
 
 
@@ -8,6 +10,8 @@ class Environment(BaseSettings):
     categories_table_name: str
     meta_table_name: str
     images_bucket_name: str
+    max_image_size: int = 10 * 1024 * 1024
+    scrape_concurrency: int = 16
 
 
 environment = Environment()
@@ -16,11 +20,14 @@ logging_config = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
+        # Importing uvicorn's formatter pulls in uvicorn itself, so only use it when serving locally
         "default": {
             "()": "uvicorn.logging.DefaultFormatter",
             "fmt": "%(levelprefix)s %(asctime)s %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
-        },
+        }
+        if "uvicorn" in sys.modules
+        else {"format": "%(levelname)s %(asctime)s %(message)s", "datefmt": "%Y-%m-%d %H:%M:%S"},
     },
     "handlers": {
         "default": {
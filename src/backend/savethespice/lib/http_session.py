@@ -0,0 +1,51 @@
+from functools import cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_TIMEOUT = (3.05, 10)  # (Connect, read) in seconds
+HTTP_MAX_HOSTS = 32  # Hosts to keep connection pools open for
+HTTP_MAX_CONNECTIONS_PER_HOST = 4
+HTTP_RETRIES = Retry(
+    total=2,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=("GET", "HEAD"),
+    raise_on_status=False,
+)
+# Some sites close their content to bots, so a browser user agent is supplied
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:86.0) Gecko/20100101 Firefox/86.0"
+}
+
+
+class _Session(requests.Session):
+    """
+    Session applying `HTTP_TIMEOUT` to requests that don't set their own.
+    """
+
+    def request(self, *args, **kwargs) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = HTTP_TIMEOUT
+        return super().request(*args, **kwargs)
+
+
+@cache
+def get_session() -> requests.Session:
+    """
+    Get the session shared by all outbound requests, which keeps connections alive across requests
+    and invocations, retries idempotent requests with backoff, and caps connections per host.
+    """
+    session = _Session()
+    session.headers.update(HTTP_HEADERS)
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_MAX_HOSTS,
+        pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST,
+        pool_block=True,
+        max_retries=HTTP_RETRIES,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
@@ -0,0 +1,334 @@
+import os
+from collections import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from hashlib import sha256
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from threading import BoundedSemaphore, Event, Lock
+from typing import Optional
+from urllib.parse import urlparse
+
+import boto3
+import requests
+from boto3.s3.transfer import TransferConfig
+from boto3_type_annotations.s3 import Client as S3Client
+from botocore.exceptions import ClientError
+from PIL import Image
+from requests.exceptions import RequestException
+from requests.utils import prepend_scheme_if_needed
+from urllib3.exceptions import HTTPError, IncompleteRead
+
+from savethespice.crud import image_refs_table
+from savethespice.lib.common import chunks, root_logger
+from savethespice.lib.config import environment
+from savethespice.lib.http_session import HTTP_MAX_CONNECTIONS_PER_HOST, get_session
+
+IMAGE_PREFIX = f"https://{os.environ.get('images_bucket_name', '')}.s3-us-west-2.amazonaws.com/"
+IMAGE_FETCH_CONCURRENCY = 8
+IMAGE_FETCH_CONCURRENCY_PER_HOST = HTTP_MAX_CONNECTIONS_PER_HOST
+# Keep at most a couple of parts in memory at a time while uploading
+IMAGE_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024, max_concurrency=2
+)
+# Longest side in pixels of each resized WebP copy stored next to the original, largest first
+IMAGE_VARIANTS = {"full": 1600, "card": 800, "thumbnail": 320}
+# Largest image decoded to create the variants, about 100 MB as RGBA. The recipes function's memory
+# is sized to decode `IMAGE_DECODE_CONCURRENCY` of them at once, each alongside a converted copy.
+IMAGE_MAX_PIXELS = 24_000_000
+IMAGE_DECODE_CONCURRENCY = 2
+logging = root_logger.getChild(__name__)
+
+# Images being stored by key, set once stored, so that requests in a batch don't upload the same
+# image at once while storing different images in parallel
+_storing: dict[str, Event] = {}
+_storing_lock = Lock()
+_decode_semaphore = BoundedSemaphore(IMAGE_DECODE_CONCURRENCY)
+# Pillow only warns up to twice this size, so `_add_image_variants` checks it as well
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+@cache
+def _get_s3_client() -> S3Client:
+    return boto3.client("s3")
+
+
+def add_image(image_source: Optional[str]) -> tuple[Optional[str], dict[str, str]]:
+    """
+    Copy an external image to the images bucket, along with resized variants of it, and add a
+    reference to it. Images are stored by content, so identical images are only stored once.
+
+    :param image_source: URL of the image
+    :return: (URL of the self-hosted image, or the original source if it couldn't be copied,
+              URLs of the resized variants by name)
+    """
+    if not image_source:
+        return None, {}
+
+    if image_source.startswith("data:image/"):
+        return image_source, {}
+
+    if image_source.startswith(IMAGE_PREFIX):
+        variants = _acquire_stored_image(image_source.removeprefix(IMAGE_PREFIX))
+        return image_source, variants or {}
+
+    try:
+        with get_session().get(
+            prepend_scheme_if_needed(image_source, "http"), stream=True
+        ) as res, SpooledTemporaryFile(max_size=1024 * 1024) as file:
+            content_type = res.headers.get("Content-Type", "").split(";")[0].strip()
+            file_type, _, extension = content_type.partition("/")
+            if not res.ok or file_type != "image" or not extension:
+                logging.info(f"Not copying {image_source} with content type {content_type}.")
+                return image_source, {}
+            if _get_content_length(res) > environment.max_image_size:
+                logging.info(f"Not copying {image_source}, larger than the maximum image size.")
+                return image_source, {}
+
+            stored = _store_image(file, _download(res, file), extension, content_type)
+            return stored or (image_source, {})
+    except (RequestException, HTTPError):
+        # Including errors while streaming the body, which may come from urllib3 directly
+        logging.info(f"Failed to download {image_source}.", exc_info=True)
+        return image_source, {}
+    except ImageTooLargeError:
+        logging.info(f"Not copying {image_source}, larger than the maximum image size.")
+        return image_source, {}
+
+
+def add_images(
+    image_sources: Iterable[Optional[str]],
+) -> list[Optional[tuple[Optional[str], dict[str, str]]]]:
+    """
+    Copy external images to the images bucket concurrently, limiting requests per host.
+
+    :param image_sources: URLs of the images
+    :return: Results of `add_image` for each image, in the same order, or None for images that
+             failed to be added, so that one failure doesn't fail the rest
+    """
+    image_sources = list(image_sources)
+    host_semaphores = {
+        _get_host(image_source): BoundedSemaphore(IMAGE_FETCH_CONCURRENCY_PER_HOST)
+        for image_source in image_sources
+        if image_source
+    }
+
+    def _add_image(image_source: Optional[str]) -> Optional[tuple[Optional[str], dict[str, str]]]:
+        if not image_source:
+            return None, {}
+        try:
+            with host_semaphores[_get_host(image_source)]:
+                return add_image(image_source)
+        except Exception:
+            logging.exception(f"Failed to add image {image_source}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_CONCURRENCY) as executor:
+        return list(executor.map(_add_image, image_sources))
+
+
+def release_images(user_id: str, image_sources: Iterable[Optional[str]]) -> None:
+    """
+    Remove a reference to each self-hosted image, deleting any images and their resized variants
+    that are no longer referenced from S3, up to 1000 per request, before they can be stored again.
+    """
+    image_keys = [
+        image_source.removeprefix(IMAGE_PREFIX)
+        for image_source in image_sources
+        if image_source and image_source.startswith(IMAGE_PREFIX)
+    ]
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_CONCURRENCY) as executor:
+        released = list(executor.map(image_refs_table.release, image_keys))
+    released_keys = [
+        image_key for image_key, is_released in zip(image_keys, released) if is_released
+    ]
+    if not released_keys:
+        return
+
+    keys = [key for image_key in released_keys for key in _get_image_keys(image_key)]
+    logging.info(f"Deleting images with keys {keys} for user with ID {user_id}.")
+    _delete_keys(keys)
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_CONCURRENCY) as executor:
+        list(executor.map(image_refs_table.set_deleted, released_keys))
+
+
+def _delete_keys(keys: list[str]) -> None:
+    for chunk in chunks(keys, batch_size=1000):
+        res = _get_s3_client().delete_objects(
+            Bucket=os.environ["images_bucket_name"],
+            Delete={"Objects": [{"Key": key} for key in chunk if key], "Quiet": True},
+        )
+        if errors := res.get("Errors"):
+            logging.error(f"Failed to delete images: {errors}")
+
+
+def _add_image_variants(stem: str, file) -> dict[str, str]:
+    """
+    Store a resized WebP copy of an image for each of `IMAGE_VARIANTS`.
+    """
+    variants: dict[str, str] = {}
+    try:
+        with _decode_semaphore, Image.open(file) as image:
+            # Only JPEGs can decode at a reduced scale, other formats always decode in full
+            largest = max(IMAGE_VARIANTS.values())
+            image.draft("RGB", (largest, largest))
+            if image.width * image.height > IMAGE_MAX_PIXELS:
+                logging.info(
+                    f"Not creating resized variants for image {stem} of size {image.size}."
+                )
+                return variants
+
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            for name, size in IMAGE_VARIANTS.items():
+                # Shrink in place, each variant starting from the previous larger one
+                image.thumbnail((size, size))
+                body = BytesIO()
+                image.save(body, "WEBP", quality=80)
+                body.seek(0)
+                _get_s3_client().put_object(
+                    Bucket=os.environ["images_bucket_name"],
+                    Key=f"{stem}-{name}.webp",
+                    Body=body,
+                    ContentType="image/webp",
+                    ACL="public-read",
+                )
+                variants[name] = f"{IMAGE_PREFIX}{stem}-{name}.webp"
+    except (Image.DecompressionBombError, OSError):
+        logging.exception(f"Failed to create resized variants for image {stem}")
+
+    return variants
+
+
+def _store_image(
+    file, stem: str, extension: str, content_type: str
+) -> Optional[tuple[str, dict[str, str]]]:
+    """
+    Store an image and its resized variants, unless an identical image is already stored.
+
+    The image only gets an entry in the image refs table once it's uploaded, so that concurrent
+    requests for the same image never reference an upload that hasn't finished or failed. Requests
+    in other processes may each upload the image, which is harmless as it's stored by content.
+    Images that are being deleted aren't stored again until they've been deleted, so that the
+    deletion doesn't remove the new copy.
+
+    :return: (URL of the self-hosted image, URLs of the resized variants by name), or None if
+             the image is being deleted
+    """
+    key = f"{stem}.{extension}"
+    while True:
+        with _storing_lock:
+            if (stored := _storing.get(key)) is None:
+                stored = _storing[key] = Event()
+                break
+        # Stored by another request in this process, which this request can then reference
+        stored.wait()
+
+    try:
+        if (variants := _acquire_stored_image(key)) is not None:
+            logging.info(f"Image is already stored with key {key}.")
+            return f"{IMAGE_PREFIX}{key}", variants
+        if (deletions := image_refs_table.get_deletions(key)) is None:
+            logging.info(f"Not storing image with key {key} while it's being deleted.")
+            return None
+
+        return _upload_image(file, stem, key, content_type, deletions)
+    finally:
+        with _storing_lock:
+            del _storing[key]
+        stored.set()
+
+
+def _upload_image(
+    file, stem: str, key: str, content_type: str, deletions: int
+) -> Optional[tuple[str, dict[str, str]]]:
+    # Variants first, as the upload closes the file
+    variants = _add_image_variants(stem, file)
+    file.seek(0)
+    _get_s3_client().upload_fileobj(
+        file,
+        os.environ["images_bucket_name"],
+        key,
+        ExtraArgs={"ContentType": content_type, "ACL": "public-read"},
+        Config=IMAGE_TRANSFER_CONFIG,
+    )
+    if not image_refs_table.create(key, variants, deletions):
+        # Stored by another request in the meantime, or deleted and possibly with this copy
+        if (variants := image_refs_table.acquire(key)) is None:
+            logging.info(f"Not storing image with key {key} deleted in the meantime.")
+            return None
+
+    return f"{IMAGE_PREFIX}{key}", variants
+
+
+def _acquire_stored_image(key: str) -> Optional[dict[str, str]]:
+    """
+    Add a reference to an image if it's already stored, including images stored before
+    references were counted, which never have an entry in the image refs table.
+
+    :return: URLs of the resized variants by name, or None if the image isn't stored
+    """
+    variants = image_refs_table.acquire(key)
+    if variants is None and _is_stored(key):
+        variants = image_refs_table.acquire(key, legacy=True)
+
+    return variants
+
+
+def _is_stored(key: str) -> bool:
+    try:
+        _get_s3_client().head_object(Bucket=os.environ["images_bucket_name"], Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "404":
+            return False
+        raise
+
+    return True
+
+
+def _download(res: requests.Response, file) -> str:
+    """
+    Copy a response body into `file`, raising if it's larger than the maximum image size or shorter
+    than its Content-Length.
+
+    :return: SHA-256 hex digest of the body
+    """
+    digest = sha256()
+    size = 0
+    for chunk in res.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > environment.max_image_size:
+            raise ImageTooLargeError
+        digest.update(chunk)
+        file.write(chunk)
+    # Compared before decoding, as the Content-Length of compressed bodies is their compressed size
+    if (received := res.raw.tell()) < (content_length := _get_content_length(res)):
+        raise IncompleteRead(received, content_length - received)
+    file.seek(0)
+
+    return digest.hexdigest()
+
+
+def _get_content_length(res: requests.Response) -> int:
+    """
+    Get the size of a response body from its headers, or 0 if it's missing or malformed.
+    """
+    try:
+        return int(res.headers.get("Content-Length", 0))
+    except ValueError:
+        return 0
+
+
+def _get_image_keys(key: str) -> list[str]:
+    """
+    Get the key of a self-hosted image along with the keys of its resized variants.
+    """
+    stem = key.rpartition(".")[0] or key
+    return [key, *(f"{stem}-{name}.webp" for name in IMAGE_VARIANTS)]
+
+
+def _get_host(image_source: str) -> str:
+    return urlparse(prepend_scheme_if_needed(image_source, "http")).netloc
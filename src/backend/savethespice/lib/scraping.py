@@ -0,0 +1,109 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from recipe_scrapers import NoSchemaFoundInWildMode, scrape_html
+from requests.utils import prepend_scheme_if_needed
+
+from savethespice.crud import scrape_cache_table
+from savethespice.lib.common import TTLCache, root_logger
+from savethespice.lib.http_session import get_session
+
+SCRAPE_CACHE_SIZE = 256
+SCRAPE_CACHE_TTL = timedelta(hours=1)  # In-process tier
+SCRAPE_SHARED_CACHE_TTL = timedelta(days=1)  # Shared tier
+DEFAULT_PORTS = {"http": 80, "https": 443}
+logging = root_logger.getChild(__name__)
+
+_cache: TTLCache[str, dict[str, Any]] = TTLCache(
+    SCRAPE_CACHE_SIZE, SCRAPE_CACHE_TTL.total_seconds()
+)
+
+
+class NoRecipeFoundError(Exception):
+    pass
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so that variations of the same page share a cache entry, dropping the
+    fragment, default port, tracking parameters, and trailing slash, and sorting the query.
+    """
+    parts = urlsplit(prepend_scheme_if_needed(url.strip(), "http"))
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+        )
+    )
+
+    return urlunsplit((scheme, host, parts.path.rstrip("/"), query, ""))
+
+
+def scrape(url: str) -> dict[str, Any]:
+    """
+    Scrape a URL for recipe info, reusing recent results for the same page.
+
+    :param url: URL of the recipe
+    :return: Scraped recipe data
+    :raises NoRecipeFoundError: If there's no recipe schema at the URL
+    :raises requests.exceptions.ConnectionError: If the URL can't be reached
+    :raises requests.exceptions.HTTPError: If the page responds with an error status
+    :raises requests.exceptions.InvalidURL: If the URL is invalid
+    :raises requests.exceptions.Timeout: If the page takes too long to respond
+    """
+    key = normalize_url(url)
+    if (data := _cache.get(key)) is None and (data := scrape_cache_table.get(key)) is not None:
+        _cache.set(key, data)
+
+    if data is None:
+        data = _scrape(url)
+        _cache.set(key, data)
+        ttl = int((datetime.now(tz=timezone.utc) + SCRAPE_SHARED_CACHE_TTL).timestamp())
+        scrape_cache_table.put(key, data, ttl)
+    else:
+        logging.info(f"Using cached scrape of {key}")
+
+    return {**data, "url": url}
+
+
+def _scrape(url: str) -> dict[str, Any]:
+    def _normalize_list(lizt: Union[str, list[str]]) -> list[str]:
+        """
+        Normalize a list or string with possible leading markers to just a list.
+        """
+        return (
+            [re.sub(r"^\d+[.:]? ?", "", entry) for entry in lizt.split("\n")]
+            if isinstance(lizt, str)
+            else lizt
+        )
+
+    # Fetched through the shared session rather than by recipe_scrapers, which opens a new
+    # connection for each page
+    res = get_session().get(prepend_scheme_if_needed(url, "http"))
+    # Error pages aren't the recipe, and shouldn't be cached as if they were
+    res.raise_for_status()
+    try:
+        scraped = scrape_html(res.text, org_url=res.url)
+    except NoSchemaFoundInWildMode as e:
+        raise NoRecipeFoundError from e
+
+    try:
+        return {
+            "url": url,
+            "name": scraped.title(),
+            "imgSrc": scraped.image(),
+            "adaptedFrom": scraped.site_name() or scraped.host(),
+            "yields": scraped.yields(),
+            "cookTime": scraped.total_time() or "",
+            "instructions": _normalize_list(scraped.instructions()),
+            "ingredients": _normalize_list(scraped.ingredients()),
+        }
+    except TypeError as e:  # Occurs upon trying to access scraped fields for failed scrape
+        raise NoRecipeFoundError from e
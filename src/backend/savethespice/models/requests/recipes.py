@@ -17,6 +17,7 @@ class RecipeBase(BaseModel):
     adaptedFrom: Optional[str]
     url: Optional[str]
     imgSrc: Optional[str]
+    imgVariants: Optional[dict[str, str]]
 
 
 class Recipe(DBItem, RecipeBase):
@@ -45,3 +46,6 @@ PatchRecipesRequest = dict[int, PatchRecipeRequest]
 
 
 PutRecipesRequest = list[PutRecipeRequest]
+
+
+ScrapeRecipesRequest = list[str]
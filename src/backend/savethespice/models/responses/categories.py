@@ -13,6 +13,7 @@ class GetCategoryResponse(BaseModel):
 class GetCategoriesResponse(BaseModel):
     class GetCategoriesResponseData(BaseModel):
         categories: list[Category]
+        nextToken: Optional[str]
 
     data: GetCategoriesResponseData
 
@@ -20,6 +21,7 @@ class GetCategoriesResponse(BaseModel):
 class DeleteCategoryResponse(BaseModel):
     class DeleteCategoryResponseData(BaseModel):
         updatedRecipes: Optional[list[int]]
+        failedRecipeUpdates: Optional[list[int]]
 
     message: Optional[str]
     data: Optional[DeleteCategoryResponseData]
@@ -30,6 +32,7 @@ class DeleteCategoriesResponse(BaseModel):
         # TODO: Prefer Iterable: https://github.com/tiangolo/fastapi/pull/3913
         updatedRecipes: Optional[list[int]]
         failedDeletions: Optional[list[int]]
+        failedRecipeUpdates: Optional[list[int]]
 
     data: Optional[DeleteCategoriesResponseData]
 
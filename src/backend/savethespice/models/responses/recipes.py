@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Union
 
 from pydantic import BaseModel
 
@@ -11,6 +11,11 @@ class ScrapeRecipeResponse(BaseModel):
     data: Optional[RecipeBase]
 
 
+class ScrapeRecipesResponseEntry(ScrapeRecipeResponse):
+    url: str
+    status: int
+
+
 class UpsertRecipeResponseData(Recipe):
     imgSrc: Optional[str]
     existingCategories: Optional[list[int]]
@@ -18,6 +23,16 @@ class UpsertRecipeResponseData(Recipe):
     categoryFailedAdds: Optional[list[str]]
 
 
+class PartialRecipe(Recipe):
+    """
+    Recipe with only the fields that were asked for.
+    """
+
+    name: Optional[str]
+    createTime: Optional[str]
+    updateTime: Optional[str]
+
+
 class GetRecipeResponse(BaseModel):
     message: Optional[str]
     data: Optional[Recipe]
@@ -25,9 +40,13 @@ class GetRecipeResponse(BaseModel):
 
 class GetRecipesResponse(BaseModel):
     class GetRecipesResponseData(BaseModel):
-        recipes: list[Recipe]
+        recipes: list[Union[Recipe, PartialRecipe]]
+        nextToken: Optional[str]
+        deletedIds: Optional[list[int]]
+        syncTime: Optional[str]
 
-    data: GetRecipesResponseData
+    message: Optional[str]
+    data: Optional[GetRecipesResponseData]
 
 
 class DeleteRecipeResponse(BaseModel):
@@ -69,7 +88,7 @@ class PutRecipesResponse(BaseModel):
         recipes: list[Recipe]
         failedAdds: Optional[list[str]]
         existingCategories: Optional[list[int]]
-        newCategories: Optional[list[int]]
-        categoryFailedAdds: Optional[list[int]]
+        newCategories: Optional[list[Category]]
+        categoryFailedAdds: Optional[list[str]]
 
     data: PutRecipesResponseData
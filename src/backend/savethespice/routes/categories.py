@@ -1,10 +1,13 @@
-import boto3
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient
+from typing import Optional
+
 from botocore.exceptions import ClientError
-from fastapi import APIRouter, Body, Request, Response, status
+from fastapi import APIRouter, Body, Query, Request, Response, status
 
 from savethespice.crud import categories_table, meta_table, recipes_table
-from savethespice.lib.common import root_logger
+from savethespice.crud.common import get_client
+from savethespice.lib.common import MAX_PAGE_SIZE, root_logger
+from savethespice.lib.conditional import get_etag, get_not_modified_response, set_validators
+from savethespice.lib.responses import get_fast_response
 from savethespice.models import (
     DeleteCategoriesRequest,
     DeleteCategoriesResponse,
@@ -20,21 +23,48 @@ from savethespice.models import (
     PutCategoryResponse,
 )
 
+CATEGORY_INDEX_FAILED_MESSAGE = "Failed to find the recipes in the categories, try again."
 logging = root_logger.getChild(__name__)
 api = APIRouter(prefix="/private/categories", tags=["categories"])
 
 
 @api.get("", response_model=GetCategoriesResponse)
-async def get_categories(req: Request):
+async def get_categories(
+    req: Request,
+    res: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    next_token: Optional[str] = Query(None, alias="nextToken"),
+):
     """
-    Get all categories in the database.
+    Get all categories in the database, or a single page of them if a limit or next token is
+    given.
     """
     user_id: str = req.scope["USER_ID"]
-    logging.info(f"Getting all categories for user with ID {user_id}.")
-    categories = categories_table.get_all(user_id)
-    logging.info("Successfully got categories.")
-
-    return {"data": {"categories": categories}}
+    version, last_modified = meta_table.get_last_modified(user_id, "categories")
+    etag = get_etag(user_id, version, str(req.query_params))
+    if not_modified_response := get_not_modified_response(req, etag, last_modified):
+        return not_modified_response
+    set_validators(res, etag, last_modified)
+
+    if limit is None and next_token is None:
+        logging.info(f"Getting all categories for user with ID {user_id}.")
+        categories = list(categories_table.get_all(user_id))
+        logging.info("Successfully got categories.")
+
+        return get_fast_response(
+            GetCategoriesResponse, {"data": {"categories": categories}}, res, validate=False
+        )
+
+    logging.info(f"Getting a page of categories for user with ID {user_id}.")
+    categories, next_token = categories_table.get_page(user_id, limit or MAX_PAGE_SIZE, next_token)
+    logging.info(f"Successfully got {len(categories)} categories.")
+
+    return get_fast_response(
+        GetCategoriesResponse,
+        {"data": {"categories": categories, "nextToken": next_token}},
+        res,
+        validate=False,
+    )
 
 
 @api.delete("", response_model=DeleteCategoriesResponse)
@@ -43,37 +73,30 @@ async def delete_categories(category_ids: DeleteCategoriesRequest, req: Request,
     Batch delete a list of category IDs from the database.
     """
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
-    failed_deletions: list[int] = []
-    updated_recipes: list[int] = []
-
-    for category_id in category_ids:
-        try:
-            categories_table.delete(user_id, category_id)
-        except client.exceptions.ConditionalCheckFailedException:
-            failed_deletions.append(category_id)
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "ValidationException":
-                failed_deletions.append(category_id)
-            raise
-        else:
-            updated_recipes.append(category_id)
-
-    if failed_deletions:
-        category_ids = [
-            category_id for category_id in category_ids if category_id not in failed_deletions
-        ]
-
-    updated_recipes = recipes_table.remove_categories_from_recipes(user_id, category_ids)
 
-    logging.info(
-        "Successfully deleted categories with IDs "
-        f"{[category_id for category_id in category_ids if category_id not in failed_deletions]}"
+    logging.info(f"Deleting categories with IDs {category_ids} for user with ID {user_id}.")
+    if not _build_category_index(user_id, category_ids):
+        res.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"message": CATEGORY_INDEX_FAILED_MESSAGE}
+    recipe_ids, failed_deletions = categories_table.delete_many(user_id, category_ids)
+    category_ids = [
+        category_id for category_id in category_ids if category_id not in failed_deletions
+    ]
+    updated_recipes, failed_recipe_updates = recipes_table.remove_categories_from_recipes(
+        user_id, category_ids, recipe_ids
     )
-    if not updated_recipes and not failed_deletions:
+
+    logging.info(f"Successfully deleted categories with IDs {category_ids}")
+    if not updated_recipes and not failed_deletions and not failed_recipe_updates:
         res.status_code = status.HTTP_204_NO_CONTENT
         return
-    return {"data": {"failedDeletions": failed_deletions, "updatedRecipes": updated_recipes}}
+    return {
+        "data": {
+            "failedDeletions": failed_deletions,
+            "updatedRecipes": updated_recipes,
+            "failedRecipeUpdates": failed_recipe_updates,
+        }
+    }
 
 
 @api.patch("", response_model=PatchCategoriesResponse)
@@ -88,14 +111,10 @@ async def patch_categories(
     Batch update a list of categories in the database.
     """
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
-    failed_updates: list[int] = []
 
-    for category_id, category in patch_request.items():
-        try:
-            categories_table.upsert(user_id, category_id, category)
-        except client.exceptions.ConditionalCheckFailedException:
-            failed_updates.append(category_id)
+    failed_updates = categories_table.update_many(
+        user_id, {category_id: category.update for category_id, category in patch_request.items()}
+    )
 
     logging.info(
         "Successfully patched categories with IDs "
@@ -147,7 +166,12 @@ async def get_category(category_id: int, req: Request, res: Response):
         return {"message": f"User {user_id} does not have a category with ID {category_id}."}
     logging.info(f"Successfully got category with ID {category_id}")
 
-    return {"data": item}
+    etag = get_etag(item.json())
+    if not_modified_response := get_not_modified_response(req, etag, item.updateTime):
+        return not_modified_response
+    set_validators(res, etag, item.updateTime)
+
+    return get_fast_response(GetCategoryResponse, {"data": item}, res, validate=False)
 
 
 @api.delete("/{category_id}", response_model=DeleteCategoryResponse)
@@ -156,11 +180,14 @@ async def delete_category(category_id: int, req: Request, res: Response):
     Delete the specified category from the database.
     """
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
+    client = get_client()
 
     logging.info(f"Deleting category with ID {category_id} for user with ID {user_id}.")
+    if not _build_category_index(user_id, [category_id]):
+        res.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"message": CATEGORY_INDEX_FAILED_MESSAGE}
     try:
-        categories_table.delete(user_id, category_id)
+        recipe_ids = categories_table.delete(user_id, category_id)
     except client.exceptions.ConditionalCheckFailedException:
         res.status_code = status.HTTP_404_NOT_FOUND
         return {"message": f"User {user_id} does not have a category with ID {category_id}."}
@@ -173,13 +200,17 @@ async def delete_category(category_id: int, req: Request, res: Response):
             }
         raise
 
-    updated_recipes = recipes_table.remove_categories_from_recipes(user_id, [category_id])
+    updated_recipes, failed_recipe_updates = recipes_table.remove_categories_from_recipes(
+        user_id, [category_id], recipe_ids
+    )
     logging.info(f"Successfully deleted category with ID {category_id}")
-    if not updated_recipes:
+    if not updated_recipes and not failed_recipe_updates:
         res.status_code = status.HTTP_204_NO_CONTENT
         return
 
-    return {"data": {"updatedRecipes": updated_recipes}}
+    return {
+        "data": {"updatedRecipes": updated_recipes, "failedRecipeUpdates": failed_recipe_updates}
+    }
 
 
 @api.patch("/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -190,14 +221,14 @@ async def patch_category(
     Patch a category in the database, updating the specified entry.
     """
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
+    client = get_client()
     category = patch_request.update
 
     logging.info(
         f"Updating category with ID {category_id} for user with ID {user_id} and body {category}."
     )
     try:
-        categories_table.upsert(user_id, category_id, category)
+        categories_table.update(user_id, category_id, category)
     except client.exceptions.ConditionalCheckFailedException:
         res.status_code = status.HTTP_404_NOT_FOUND
         return {"message": f"User {user_id} does not have a category with ID {category_id}."}
@@ -218,3 +249,28 @@ async def put_category(category_id: int, category: PutCategoryRequest, req: Requ
     logging.info(f"Successfully put category with ID {category_id}")
 
     return {"data": item}
+
+
+def _build_category_index(user_id: str, category_ids: list[int]) -> bool:
+    """
+    Record the recipes in each category for users whose recipes were written before categories
+    tracked them, or who had an update to the index fail, so that deleting a category can find
+    its recipes without reading every recipe.
+
+    :param user_id: ID of the user
+    :param category_ids: IDs of the categories being deleted, only building the index if any of
+                         them exist
+    :return: Whether the recipes in each category can be relied on
+    """
+    is_built, invalidations = meta_table.get_category_index_state(user_id)
+    if is_built or not categories_table.get_existing_ids(user_id, category_ids):
+        return True
+
+    logging.info(f"Building the category index for user with ID {user_id}.")
+    if not categories_table.update_recipe_index(
+        user_id, added=recipes_table.get_category_index(user_id)
+    ):
+        return False
+
+    # Another update failing in the meantime may have been missed
+    return meta_table.set_category_index_built(user_id, invalidations)
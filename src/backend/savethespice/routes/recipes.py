@@ -1,23 +1,28 @@
-import os
-import re
-from collections import Iterable
+from collections import Iterable, Iterator, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from typing import Optional, TypedDict, Union, cast
-from uuid import uuid4
 
-import boto3
-import requests
-from boto3_type_annotations.dynamodb import Client as DynamoDBClient
-from boto3_type_annotations.s3 import Object
 from botocore.exceptions import ClientError
-from fastapi import APIRouter, Request, Response, status
-
-# noinspection PyProtectedMember
-from recipe_scrapers import NoSchemaFoundInWildMode, scrape_me
-from requests.exceptions import ConnectionError, InvalidURL
-from requests.utils import prepend_scheme_if_needed
-
-from savethespice.crud import categories_table, meta_table, recipes_table
-from savethespice.lib.common import pformat, root_logger
+from fastapi import APIRouter, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+
+from savethespice.crud import (
+    categories_table,
+    meta_table,
+    recipe_tombstones_table,
+    recipes_table,
+)
+from savethespice.crud.common import get_client
+from savethespice.crud.recipe_tombstones_table import RECIPE_TOMBSTONE_TTL
+from savethespice.lib.common import MAX_PAGE_SIZE, pformat, root_logger
+from savethespice.lib.conditional import (
+    get_etag,
+    get_not_modified_response,
+    set_validators,
+)
+from savethespice.lib.config import environment
+from savethespice.lib.responses import get_fast_response
 from savethespice.models import (
     Category,
     DeleteRecipeResponse,
@@ -34,24 +39,171 @@ from savethespice.models import (
     Recipe,
     RecipeBase,
     ScrapeRecipeResponse,
+    ScrapeRecipesRequest,
+    ScrapeRecipesResponseEntry,
 )
 
-IMAGE_PREFIX = f"https://{os.environ.get('images_bucket_name', '')}.s3-us-west-2.amazonaws.com/"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# How far the sync time trails the read, as changes reach the update time index asynchronously
+SYNC_LAG = timedelta(seconds=10)
+MAX_SCRAPE_URLS = 200
 logging = root_logger.getChild(__name__)
 api = APIRouter(prefix="/private", tags=["recipes"])
 
+# `images` and `scraping` are imported by the routes that use them, since they pull in Pillow and
+# recipe_scrapers, which reads shouldn't pay for at cold start
+
 
-@api.get("/recipes", response_model=GetRecipesResponse)
-async def get_recipes(req: Request):
+@api.get(
+    "/recipes",
+    response_model=GetRecipesResponse,
+    responses={status.HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def get_recipes(
+    req: Request,
+    res: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    next_token: Optional[str] = Query(None, alias="nextToken"),
+    ids: Optional[list[int]] = Query(None, max_items=MAX_PAGE_SIZE),
+    since: Optional[str] = None,
+    fields: Optional[str] = Query(
+        None,
+        description="Comma separated fields to get, or presets of fields such as `summary`",
+        example="summary",
+    ),
+):
     """
-    Get all recipes in the database.
+    Get all recipes in the database, or a single page of them if a limit or next token is given.
+    If newline delimited JSON is accepted, all recipes are instead streamed one per line, which
+    can't be combined with a limit or next token. API Gateway buffers the whole stream, so it's
+    still bound by the response size limit, and large libraries should be fetched in pages. If IDs
+    are given, only the recipes with those IDs that exist are returned. If a time is given, only
+    the recipes changed since then are returned, along with the IDs of recipes deleted since then
+    and the time to sync from next. Syncs overlap, so clients should expect changes more than
+    once and apply them by recipe ID. If fields are given, recipes only include those fields.
     """
     user_id: str = req.scope["USER_ID"]
-    logging.info(f"Getting all recipes for user with ID {user_id}.")
-    recipes = recipes_table.get_all(user_id)
-    logging.info("Successfully got recipes.")
+    recipe_fields = _parse_fields(fields)
+    stream = NDJSON_MEDIA_TYPE in req.headers.get("Accept", "")
+    if stream and (limit is not None or next_token is not None):
+        res.status_code = status.HTTP_400_BAD_REQUEST
+        return {"message": "Pages of recipes can't be streamed, accept JSON to get a page."}
+    version, last_modified = meta_table.get_last_modified(user_id, "recipes")
+    etag = get_etag(user_id, version, stream, str(req.query_params))
+    if not_modified_response := get_not_modified_response(req, etag, last_modified):
+        return not_modified_response
+    set_validators(res, etag, last_modified)
+
+    if ids:
+        logging.info(f"Getting recipes with IDs {ids} for user with ID {user_id}.")
+        recipes = recipes_table.get_many(user_id, ids, recipe_fields)
+        logging.info(f"Successfully got {len(recipes)} recipes.")
+
+        return get_fast_response(
+            GetRecipesResponse,
+            {"data": {"recipes": recipes}},
+            res,
+            exclude_unset=recipe_fields is not None,
+            validate=False,
+        )
 
-    return {"data": {"recipes": recipes}}
+    if since:
+        return get_fast_response(
+            GetRecipesResponse,
+            _get_recipes_since(user_id, since, res, recipe_fields),
+            res,
+            exclude_unset=recipe_fields is not None,
+            validate=False,
+        )
+
+    if stream:
+        logging.info(f"Streaming all recipes for user with ID {user_id}.")
+        streaming_res = StreamingResponse(
+            (
+                f"{recipe.json(exclude_unset=recipe_fields is not None)}\n"
+                for recipe in recipes_table.get_all(user_id, recipe_fields)
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+        set_validators(streaming_res, etag, last_modified)
+        return streaming_res
+
+    if limit is None and next_token is None:
+        logging.info(f"Getting all recipes for user with ID {user_id}.")
+        recipes = list(recipes_table.get_all(user_id, recipe_fields))
+        logging.info("Successfully got recipes.")
+
+        return get_fast_response(
+            GetRecipesResponse,
+            {"data": {"recipes": recipes}},
+            res,
+            exclude_unset=recipe_fields is not None,
+            validate=False,
+        )
+
+    logging.info(f"Getting a page of recipes for user with ID {user_id}.")
+    recipes, next_token = recipes_table.get_page(
+        user_id, limit or MAX_PAGE_SIZE, next_token, recipe_fields
+    )
+    logging.info(f"Successfully got {len(recipes)} recipes.")
+
+    return get_fast_response(
+        GetRecipesResponse,
+        {"data": {"recipes": recipes, "nextToken": next_token}},
+        res,
+        exclude_unset=recipe_fields is not None,
+        validate=False,
+    )
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[list[str]]:
+    """
+    Expand the fields asked for into recipe fields, always including the recipe ID.
+
+    :param fields: Comma separated fields or presets of fields, if any were asked for
+    :return: Recipe fields, or None for all of them
+    """
+    if fields is None:
+        return None
+
+    recipe_fields = {"recipeId"}
+    for field in filter(None, (field.strip() for field in fields.split(","))):
+        recipe_fields.update(recipes_table.RECIPE_FIELD_PRESETS.get(field, [field]))
+    unknown_fields = recipe_fields.difference(recipes_table.RECIPE_FIELDS)
+    assert not unknown_fields, f"Unknown fields: {sorted(unknown_fields)}."
+
+    return [field for field in recipes_table.RECIPE_FIELDS if field in recipe_fields]
+
+
+def _get_recipes_since(
+    user_id: str, since: str, res: Response, fields: Optional[list[str]]
+) -> dict:
+    try:
+        since_time = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except ValueError:
+        raise AssertionError(f"{since} is not a valid ISO time.")
+    if not since_time.tzinfo:
+        since_time = since_time.replace(tzinfo=timezone.utc)
+    # Taken before reading and backed off, so that changes made while reading or not yet in the
+    # index are picked up by the next sync
+    sync_time = (datetime.now(tz=timezone.utc) - SYNC_LAG).replace(microsecond=0).isoformat()
+    if since_time < datetime.now(tz=timezone.utc) - RECIPE_TOMBSTONE_TTL:
+        res.status_code = status.HTTP_410_GONE
+        return {"message": f"Changes from before {RECIPE_TOMBSTONE_TTL} ago require a full sync."}
+    since = since_time.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+
+    logging.info(f"Getting recipes changed since {since} for user with ID {user_id}.")
+    recipes = recipes_table.get_changed_since(user_id, since, fields)
+    changed_ids = {recipe.recipeId for recipe in recipes}
+    deleted_ids = [
+        recipe_id
+        for recipe_id in recipe_tombstones_table.get_deleted_since(user_id, since)
+        # Recreated since being deleted
+        if recipe_id not in changed_ids
+    ]
+    logging.info(f"Successfully got {len(recipes)} changed and {len(deleted_ids)} deleted recipes.")
+
+    return {"data": {"recipes": recipes, "deletedIds": deleted_ids, "syncTime": sync_time}}
 
 
 @api.delete("/recipes", response_model=DeleteRecipesResponse)
@@ -59,23 +211,16 @@ async def delete_recipes(recipe_ids: DeleteRecipesRequest, req: Request, res: Re
     """
     Batch delete a list of recipe IDs from the database.
     """
+    from savethespice.lib import images
+
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
-    failed_deletions: list[int] = []
-
-    for recipe_id in recipe_ids:
-        logging.info(f"Deleting recipe with ID {recipe_id} for user with ID {user_id}.")
-        try:
-            image_source = recipes_table.delete(user_id, recipe_id)
-        except (client.exceptions.ConditionalCheckFailedException, ClientError):
-            failed_deletions.append(recipe_id)
-        else:
-            if image_source and image_source.startswith(IMAGE_PREFIX):
-                # Delete self-hosted image from S3
-                key = image_source.removeprefix(IMAGE_PREFIX)
-                logging.info(f"Deleting image with key {key} for user with ID {user_id}.")
-                image: Object = boto3.resource("s3").Object(os.environ["images_bucket_name"], key)
-                image.delete()
+
+    logging.info(f"Deleting recipes with IDs {recipe_ids} for user with ID {user_id}.")
+    image_sources, removed_categories, failed_deletions = recipes_table.delete_many(
+        user_id, recipe_ids
+    )
+    images.release_images(user_id, image_sources)
+    categories_table.update_recipe_index(user_id, removed=removed_categories)
 
     logging.info(
         "Successfully deleted recipes with IDs "
@@ -141,31 +286,68 @@ async def post_recipe(recipe: PostRecipeRequest, req: Request):
 
 
 @api.put("/recipes", response_model=PutRecipesResponse)
-async def put_recipes(recipes: PutRecipesRequest, req: Request):
+def put_recipes(recipes: PutRecipesRequest, req: Request):
     """
     Batch put a list of recipes to the database.
     """
-    user_id: str = req.scope["USER_ID"]
-    res_data = {
-        "recipes": [],
-        "existingCategories": [],
-        "newCategories": [],
-        "categoryFailedAdds": [],
-    }
+    from savethespice.lib import images
 
+    user_id: str = req.scope["USER_ID"]
     logging.info(f"Batch adding recipes from body {recipes}")
-    for recipe in recipes:
-        recipe_id = meta_table.get_next_id(user_id, "recipe")
-        logging.info(
-            f"Creating recipe with ID {recipe_id} for user with ID {user_id} and body {recipe}."
+    if not recipes:
+        return {"data": {"recipes": []}}
+
+    # Resolve every category name across the batch at once
+    (
+        existing_categories,
+        new_categories,
+        category_failed_adds,
+    ) = categories_table.add_categories_by_name(
+        user_id, {category for recipe in recipes for category in recipe.categories or []}
+    )
+    category_ids = {
+        **existing_categories,
+        **{category.name: category.categoryId for category in new_categories},
+    }
+    recipe_ids = meta_table.get_next_ids(user_id, "recipe", len(recipes))
+    added_images = images.add_images(recipe.imgSrc for recipe in recipes)
+
+    bodies: dict[int, RecipeBase] = {}
+    failed_adds: list[str] = []
+    for recipe, recipe_id, added_image in zip(recipes, recipe_ids, added_images):
+        if added_image is None:
+            failed_adds.append(recipe.name)
+            continue
+        image_source, variants = added_image
+        bodies[recipe_id] = RecipeBase(
+            **recipe.dict(exclude={"imgSrc", "imgVariants", "categories"}),
+            imgSrc=image_source,
+            imgVariants=variants,
+            categories=[
+                category_ids[category]
+                for category in recipe.categories or []
+                if category in category_ids
+            ],
         )
-        item, add_categories_from_recipe_response = _upsert_recipe(user_id, recipe_id, recipe)
-        for k, v in add_categories_from_recipe_response.items():
-            res_data[k].extend(v)
-        res_data["recipes"].append(item)
-    logging.info(f"Successfully put recipes with names {[recipe.name for recipe in recipes]}")
-
-    return {"data": res_data}
+    items, failed_ids = recipes_table.put_many(user_id, bodies)
+    failed_adds.extend(bodies[recipe_id].name for recipe_id in failed_ids)
+    images.release_images(user_id, [bodies[recipe_id].imgSrc for recipe_id in failed_ids])
+    added_categories: dict[int, set[int]] = defaultdict(set)
+    for item in items:
+        for category_id in item.categories or []:
+            added_categories[category_id].add(item.recipeId)
+    categories_table.update_recipe_index(user_id, added=added_categories)
+    logging.info(f"Successfully put recipes with IDs {[item.recipeId for item in items]}")
+
+    return {
+        "data": {
+            "recipes": items,
+            "failedAdds": failed_adds,
+            "existingCategories": list(existing_categories.values()),
+            "newCategories": new_categories,
+            "categoryFailedAdds": category_failed_adds,
+        }
+    }
 
 
 @api.get("/recipes/{recipe_id}", response_model=GetRecipeResponse)
@@ -191,7 +373,12 @@ async def get_recipe(recipe_id: int, req: Request, res: Response):
         return {"message": f"User {user_id} does not have a recipe with ID {recipe_id}."}
     logging.info(f"Successfully got recipe with ID {recipe_id}")
 
-    return {"data": item}
+    etag = get_etag(item.json())
+    if not_modified_response := get_not_modified_response(req, etag, item.updateTime):
+        return not_modified_response
+    set_validators(res, etag, item.updateTime)
+
+    return get_fast_response(GetRecipeResponse, {"data": item}, res, validate=False)
 
 
 @api.delete("/recipes/{recipe_id}", response_model=DeleteRecipeResponse)
@@ -199,12 +386,14 @@ async def delete_recipe(recipe_id: int, req: Request, res: Response):
     """
     Delete a recipe in the database by ID.
     """
+    from savethespice.lib import images
+
     user_id: str = req.scope["USER_ID"]
-    client: DynamoDBClient = boto3.client("dynamodb")
+    client = get_client()
 
     logging.info(f"Deleting recipe with ID {recipe_id} for user with ID {user_id}.")
     try:
-        image_source = recipes_table.delete(user_id, recipe_id)
+        image_source, category_ids = recipes_table.delete(user_id, recipe_id)
     except client.exceptions.ConditionalCheckFailedException:
         res.status_code = status.HTTP_404_NOT_FOUND
         return {"message": f"User {user_id} does not have a recipe with ID {recipe_id}."}
@@ -217,12 +406,10 @@ async def delete_recipe(recipe_id: int, req: Request, res: Response):
             }
         raise
 
-    if image_source and image_source.startswith(IMAGE_PREFIX):
-        # Delete self-hosted image from S3
-        key = image_source.removeprefix(IMAGE_PREFIX)
-        logging.info(f"Deleting image with key {key} for user with ID {user_id}.")
-        image: Object = boto3.resource("s3").Object(os.environ["images_bucket_name"], key)
-        image.delete()
+    images.release_images(user_id, [image_source])
+    categories_table.update_recipe_index(
+        user_id, removed={category_id: [recipe_id] for category_id in category_ids}
+    )
 
     logging.info(f"Successfully deleted recipe with ID {recipe_id}")
     res.status_code = status.HTTP_204_NO_CONTENT
@@ -273,7 +460,7 @@ async def delete_recipe(recipe_id: int, req: Request, res: Response):
 #         remove_kwargs["ExpressionAttributeValues"][f":{c}"] = set(removes.categories)
 #
 #     if updates:
-#         image_source = _add_image_from_recipe(updates.imgSrc)
+#         image_source, _ = images.add_image(updates.imgSrc)
 #         if image_source:
 #             res_data["imgSrc"] = image_source
 #
@@ -332,7 +519,10 @@ async def put_recipe(recipe_id: int, recipe: PutRecipeRequest, req: Request):
     logging.info(
         f"Updating recipe with ID {recipe_id} for user with ID {user_id} and body {recipe}."
     )
-    item, add_categories_from_recipe_response = _upsert_recipe(user_id, recipe_id, recipe)
+    *old_image, old_categories = recipes_table.get_image_and_categories(user_id, recipe_id)
+    item, add_categories_from_recipe_response = _upsert_recipe(
+        user_id, recipe_id, recipe, tuple(old_image), old_categories
+    )
     logging.info(f"Successfully put recipe with ID {recipe_id}")
 
     return {"data": {**item.dict(), **add_categories_from_recipe_response}}
@@ -343,67 +533,69 @@ async def scrape_recipe(url: str, res: Response):
     """
     Scrape a url for recipe info.
     """
+    res.status_code, body = _scrape_recipe(url)
 
-    def _normalize_list(lizt: Union[str, list[str]]) -> list[str]:
-        """
-        Normalize a list or string with possible leading markers to just a list.
-        """
-        return (
-            [re.sub(r"^\d+[.:]? ?", "", entry) for entry in lizt.split("\n")]
-            if isinstance(lizt, str)
-            else lizt
-        )
+    return body
 
-    logging.info(f"Scraping url: {url}")
-    try:
-        scraped = scrape_me(prepend_scheme_if_needed(url, "http"), wild_mode=True)
-    except NoSchemaFoundInWildMode:
-        return {"message": f"No recipe schema found at {url}"}
-    except (ConnectionError, InvalidURL):
-        res.status_code = status.HTTP_404_NOT_FOUND
-        return {"message": f"{url} is not a valid url."}
 
-    try:
-        data = {
-            "url": url,
-            "name": scraped.title(),
-            "imgSrc": scraped.image(),
-            "adaptedFrom": scraped.site_name() or scraped.host(),
-            "yields": scraped.yields(),
-            "cookTime": scraped.total_time() or "",
-            "instructions": _normalize_list(scraped.instructions()),
-            "ingredients": _normalize_list(scraped.ingredients()),
-        }
-    except TypeError:  # Occurs upon trying to access scraped fields for failed scrape
-        return {"message": f"No recipe schema found at {url}"}
-
-    logging.info(f"Found data:\n{pformat(data)}")
-    return {"data": data}
-
-
-def _add_image_from_recipe(image_source: str) -> Optional[str]:
-    if not image_source:
-        return None
+@api.post(
+    "/scrape",
+    response_class=StreamingResponse,
+    responses={status.HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+async def scrape_recipes(urls: ScrapeRecipesRequest):
+    """
+    Scrape a list of urls for recipe info concurrently, streaming the result for each url as
+    newline delimited JSON as soon as it's ready. Each line is a ScrapeRecipesResponseEntry.
+    """
+    urls = list(dict.fromkeys(urls))
+    assert len(urls) <= MAX_SCRAPE_URLS, f"At most {MAX_SCRAPE_URLS} urls can be scraped at once."
+
+    def _scrape_recipes() -> Iterator[str]:
+        with ThreadPoolExecutor(max_workers=environment.scrape_concurrency) as executor:
+            futures = {executor.submit(_scrape_recipe, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    status_code, body = future.result()
+                    entry = ScrapeRecipesResponseEntry(url=url, status=status_code, **body)
+                except Exception:
+                    logging.exception(f"Failed to scrape {url}")
+                    entry = ScrapeRecipesResponseEntry(
+                        url=url,
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        message=f"Failed to scrape {url}",
+                    )
+                yield f"{entry.json(exclude_none=True)}\n"
+
+    logging.info(f"Scraping {len(urls)} urls.")
+    return StreamingResponse(_scrape_recipes(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def _scrape_recipe(url: str) -> tuple[int, dict]:
+    """
+    :return: (Status code, Response body)
+    """
+    from requests.exceptions import ConnectionError, HTTPError, InvalidURL, Timeout
 
-    if image_source.startswith(IMAGE_PREFIX) or image_source.startswith("data:image/"):
-        # Already self-hosted or data URL
-        return image_source
+    from savethespice.lib import scraping
 
-    key = str(uuid4())
+    logging.info(f"Scraping url: {url}")
     try:
-        with requests.get(prepend_scheme_if_needed(image_source, "http"), stream=True) as res:
-            content_type = res.headers["Content-Type"]
-            file_type, extension = content_type.rsplit("/")
-            if res.ok and file_type == "image":
-                image: Object = boto3.resource("s3").Object(
-                    os.environ["images_bucket_name"], f"{key}.{extension}"
-                )
-                image.put(Body=res.content, ContentType=content_type, ACL="public-read")
-                image_source = f"{IMAGE_PREFIX}{key}.{extension}"
+        data = scraping.scrape(url)
+    except scraping.NoRecipeFoundError:
+        return status.HTTP_200_OK, {"message": f"No recipe schema found at {url}"}
     except (ConnectionError, InvalidURL):
-        pass
+        return status.HTTP_404_NOT_FOUND, {"message": f"{url} is not a valid url."}
+    except Timeout:
+        return status.HTTP_504_GATEWAY_TIMEOUT, {"message": f"Timed out fetching {url}"}
+    except HTTPError as e:
+        return status.HTTP_502_BAD_GATEWAY, {
+            "message": f"Fetching {url} failed with status {e.response.status_code}"
+        }
 
-    return image_source
+    logging.info(f"Found data:\n{pformat(data)}")
+    return status.HTTP_200_OK, {"data": data}
 
 
 class AddCategoriesFromRecipeResponse(TypedDict):
@@ -421,28 +613,54 @@ def _add_categories_from_recipe(
     categories = {
         categoryId
         for categoryId in (
-            *existing_categories,
+            *existing_categories.values(),
             *(category.categoryId for category in new_categories),
         )
     }
 
     return categories, AddCategoriesFromRecipeResponse(
-        existingCategories=existing_categories,
+        existingCategories=list(existing_categories.values()),
         newCategories=new_categories,
         categoryFailedAdds=failed_adds,
     )
 
 
 def _upsert_recipe(
-    user_id: str, recipe_id: int, recipe: Union[PostRecipeRequest, PutRecipeRequest]
+    user_id: str,
+    recipe_id: int,
+    recipe: Union[PostRecipeRequest, PutRecipeRequest],
+    old_image: tuple[Optional[str], dict[str, str]] = (None, {}),
+    old_categories: Iterable[int] = (),
 ) -> tuple[Recipe, AddCategoriesFromRecipeResponse]:
+    from savethespice.lib import images
+
     categories, res_data = _add_categories_from_recipe(user_id, recipe.categories)
-    image_source = _add_image_from_recipe(recipe.imgSrc)
+    old_image_source, old_variants = old_image
+    if recipe.imgSrc and recipe.imgSrc == old_image_source:
+        # Unchanged, the recipe already holds a reference to it
+        image_source, variants = old_image_source, old_variants
+    else:
+        image_source, variants = images.add_image(recipe.imgSrc)
     body = RecipeBase(
-        **recipe.dict(exclude={"imgSrc", "categories"}),
+        **recipe.dict(exclude={"imgSrc", "imgVariants", "categories"}),
         imgSrc=image_source,
+        imgVariants=variants,
         categories=cast(list, categories),
     )
-    item = recipes_table.upsert(user_id, recipe_id, body)
+    try:
+        item = recipes_table.upsert(user_id, recipe_id, body)
+    except Exception:
+        if image_source != old_image_source:
+            images.release_images(user_id, [image_source])
+        raise
+
+    if image_source != old_image_source:
+        images.release_images(user_id, [old_image_source])
+    old_categories = set(old_categories)
+    categories_table.update_recipe_index(
+        user_id,
+        added={category_id: [recipe_id] for category_id in categories - old_categories},
+        removed={category_id: [recipe_id] for category_id in old_categories - categories},
+    )
 
     return item, res_data
@@ -5,6 +5,7 @@ from fastapi import APIRouter, Request, Response, status
 
 from savethespice.crud import recipes_table, share_table
 from savethespice.lib.common import root_logger
+from savethespice.lib.responses import get_fast_response
 from savethespice.models import (
     CreateShareLinkRequest,
     CreateShareLinkResponse,
@@ -27,7 +28,7 @@ async def get(share_id: str, res: Response):
         return {"message": f"Share ID {share_id} is not valid."}
     logging.info(f"Successfully got recipe from share ID {share_id}")
 
-    return {"data": item}
+    return get_fast_response(GetRecipeWithShareIdResponse, {"data": item}, res, validate=False)
 
 
 @api.post("", response_model=CreateShareLinkResponse)
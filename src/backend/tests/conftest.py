@@ -0,0 +1,137 @@
+"""
+Fixtures backing the app with mocked AWS resources shaped like those in the CDK stack, and serving
+pages and images from a local server.
+"""
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Thread
+
+# Read when savethespice is imported
+os.environ.update(
+    client_id="client",
+    user_pool_id="user-pool",
+    meta_table_name="TestMeta",
+    recipes_table_name="TestRecipes",
+    categories_table_name="TestCategories",
+    share_table_name="TestShares",
+    image_refs_table_name="TestImageRefs",
+    scrape_cache_table_name="TestScrapeCache",
+    recipe_tombstones_table_name="TestRecipeTombstones",
+    images_bucket_name="test-images",
+    AWS_DEFAULT_REGION="us-west-2",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+)
+
+import boto3  # noqa: E402
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from moto import mock_dynamodb, mock_s3  # noqa: E402
+from PIL import Image  # noqa: E402
+
+USER_ID = "00000000-0000-0000-0000-000000000000"
+
+# (Partition key, Sort key, Global secondary index sort key) by table, as in the CDK stack
+TABLES = {
+    "meta_table_name": (("userId", "S"), None, None),
+    "recipes_table_name": (("userId", "S"), ("recipeId", "N"), ("updateTime", "S")),
+    "categories_table_name": (("userId", "S"), ("categoryId", "N"), ("name", "S")),
+    "share_table_name": (("shareId", "S"), None, None),
+    "image_refs_table_name": (("imageKey", "S"), None, None),
+    "scrape_cache_table_name": (("url", "S"), None, None),
+    "recipe_tombstones_table_name": (("userId", "S"), ("recipeId", "N"), None),
+}
+
+
+def _create_table(client, table_name: str, partition_key, sort_key, index_sort_key) -> None:
+    attributes = [partition_key, *(key for key in (sort_key, index_sort_key) if key)]
+    key_schema = [{"AttributeName": partition_key[0], "KeyType": "HASH"}]
+    if sort_key:
+        key_schema.append({"AttributeName": sort_key[0], "KeyType": "RANGE"})
+    kwargs = {}
+    if index_sort_key:
+        kwargs["GlobalSecondaryIndexes"] = [
+            {
+                "IndexName": f"{partition_key[0]}-{index_sort_key[0]}-index",
+                "KeySchema": [
+                    {"AttributeName": partition_key[0], "KeyType": "HASH"},
+                    {"AttributeName": index_sort_key[0], "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            }
+        ]
+
+    client.create_table(
+        TableName=table_name,
+        AttributeDefinitions=[{"AttributeName": n, "AttributeType": t} for n, t in attributes],
+        KeySchema=key_schema,
+        BillingMode="PAY_PER_REQUEST",
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def aws():
+    """
+    Mock DynamoDB and S3 with empty tables and an empty images bucket.
+    """
+    from savethespice.lib import scraping
+
+    with mock_dynamodb(), mock_s3():
+        client = boto3.client("dynamodb")
+        for env_name, keys in TABLES.items():
+            _create_table(client, os.environ[env_name], *keys)
+        boto3.client("s3").create_bucket(
+            Bucket=os.environ["images_bucket_name"],
+            CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+        )
+        yield
+        scraping._cache._entries.clear()
+
+
+@pytest.fixture
+def client(aws) -> TestClient:
+    from savethespice.index import app
+
+    return TestClient(app)
+
+
+def get_jpeg(size: tuple[int, int] = (2000, 1500), color: tuple[int, int, int] = (200, 10, 10)):
+    body = BytesIO()
+    Image.new("RGB", size, color).save(body, "JPEG")
+    return body.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    pages: dict[str, tuple[int, str, bytes]] = {}
+
+    def do_GET(self):
+        status, content_type, body = self.pages.get(self.path, (404, "text/html", b"Not found"))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def _server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def pages(_server):
+    """
+    Serve responses from a local server, set by path as (Status, Content type, Body).
+
+    :return: (URL of the server, Responses by path)
+    """
+    yield _server, _Handler.pages
+    _Handler.pages.clear()
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+from conftest import USER_ID
+from fastapi.testclient import TestClient
+
+from savethespice.crud import meta_table, recipes_table
+from savethespice.crud.common import get_client
+from savethespice.routes import categories
+from savethespice.routes.categories import _build_category_index
+
+
+@pytest.fixture
+def unindexed(client: TestClient) -> TestClient:
+    """
+    Categories with recipes written before the recipes in each category were tracked.
+    """
+    for name in ("Dinner", "Quick"):
+        assert client.post("/private/categories", json={"name": name}).status_code == 201
+    res = client.put(
+        "/private/recipes",
+        json=[
+            {"name": "Soup", "categories": ["Dinner", "Quick"]},
+            {"name": "Salad", "categories": ["Quick"]},
+            {"name": "Toast"},
+        ],
+    )
+    assert res.status_code == 200, res.text
+    for category_id in (0, 1):
+        get_client().update_item(
+            TableName=os.environ["categories_table_name"],
+            Key={"userId": {"S": USER_ID}, "categoryId": {"N": str(category_id)}},
+            UpdateExpression="REMOVE recipeIds",
+        )
+
+    return client
+
+
+def _get_recipe_ids(category_id: int) -> set[int]:
+    item = get_client().get_item(
+        TableName=os.environ["categories_table_name"],
+        Key={"userId": {"S": USER_ID}, "categoryId": {"N": str(category_id)}},
+    )["Item"]
+    return {int(recipe_id) for recipe_id in item.get("recipeIds", {}).get("NS", [])}
+
+
+def test_build(unindexed: TestClient):
+    assert _build_category_index(USER_ID, [1])
+
+    assert _get_recipe_ids(0) == {0}
+    assert _get_recipe_ids(1) == {0, 1}
+    assert meta_table.get_category_index_state(USER_ID) == (True, 0)
+
+
+def test_only_built_once(unindexed: TestClient, monkeypatch):
+    assert _build_category_index(USER_ID, [0])
+    monkeypatch.setattr(recipes_table, "get_category_index", pytest.fail)
+
+    assert _build_category_index(USER_ID, [0])
+
+
+def test_not_built_without_existing_categories(unindexed: TestClient):
+    assert _build_category_index(USER_ID, [2, 3])
+
+    assert _get_recipe_ids(0) == set()
+    assert meta_table.get_category_index_state(USER_ID) == (False, 0)
+
+
+def test_not_built_if_invalidated_while_building(unindexed: TestClient, monkeypatch):
+    get_category_index = recipes_table.get_category_index
+
+    def _get_category_index(user_id: str) -> dict[int, set[int]]:
+        # Another request failing to update the index in the meantime
+        meta_table.invalidate_category_index(user_id)
+        return get_category_index(user_id)
+
+    monkeypatch.setattr(recipes_table, "get_category_index", _get_category_index)
+
+    assert not _build_category_index(USER_ID, [0])
+    assert meta_table.get_category_index_state(USER_ID) == (False, 1)
+
+
+def test_not_built_if_update_fails(unindexed: TestClient, monkeypatch):
+    monkeypatch.setattr(categories.categories_table, "update_recipe_index", lambda *_, **__: False)
+
+    assert not _build_category_index(USER_ID, [0])
+    assert meta_table.get_category_index_state(USER_ID) == (False, 0)
+
+
+def test_delete_category_uses_built_index(unindexed: TestClient):
+    res = unindexed.delete("/private/categories/1")
+
+    assert res.status_code == 200, res.text
+    assert res.json()["data"]["updatedRecipes"] == [0, 1]
+    recipes = unindexed.get("/private/recipes").json()["data"]["recipes"]
+    assert [recipe["categories"] for recipe in recipes] == [[0], None, None]
@@ -0,0 +1,76 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from savethespice.crud.codec import deserialize, deserialize_field, deserialize_item, serialize
+from savethespice.crud.common import get_client, get_item_from_table, put_item_in_table
+
+
+@pytest.mark.parametrize(
+    "value, attribute",
+    [
+        ("Soup", {"S": "Soup"}),
+        (5, {"N": "5"}),
+        (Decimal("1.5"), {"N": "1.5"}),
+        # Checked before ints, which they are
+        (True, {"BOOL": True}),
+        (None, {"NULL": True}),
+        (b"\x00", {"B": b"\x00"}),
+        (["Soup", 5], {"L": [{"S": "Soup"}, {"N": "5"}]}),
+        ({5}, {"NS": ["5"]}),
+        ({"5"}, {"SS": ["5"]}),
+        (
+            {"name": "Soup", "details": {"serves": 2, "tags": ["Quick"]}},
+            {
+                "M": {
+                    "name": {"S": "Soup"},
+                    "details": {"M": {"serves": {"N": "2"}, "tags": {"L": [{"S": "Quick"}]}}},
+                }
+            },
+        ),
+    ],
+)
+def test_round_trip(value, attribute):
+    assert serialize(value) == attribute
+    assert deserialize(attribute) == value
+
+
+def test_number_types():
+    assert type(deserialize({"N": "5"})) is int
+    assert deserialize({"N": "1.50"}) == Decimal("1.5")
+    assert deserialize({"NS": ["1", "1.5"]}) == {1, Decimal("1.5")}
+
+
+def test_sets():
+    assert sorted(serialize({3, 1, 2})["NS"]) == ["1", "2", "3"]
+    assert sorted(serialize(frozenset({"b", "a"}))["SS"]) == ["a", "b"]
+
+
+def test_empty_set():
+    assert serialize(set()) == {"NULL": True}
+    assert deserialize(serialize(set())) is None
+
+
+def test_write_empty_set(aws):
+    table, client = os.environ["meta_table_name"], get_client()
+
+    put_item_in_table(client, table, item={"userId": "user", "tags": set()})
+
+    assert deserialize_item(get_item_from_table(client, table, key={"userId": "user"})) == {
+        "userId": "user",
+        "tags": None,
+    }
+
+
+@pytest.mark.parametrize("value", [{1, "1"}, {True}, {1.5}, object()])
+def test_unsupported(value):
+    with pytest.raises(TypeError):
+        serialize(value)
+
+
+def test_deserialize_field():
+    assert deserialize_field({"NS": ["2", "1"]}) in ([1, 2], [2, 1])
+    assert deserialize_field({"L": [{"S": "a"}]}) == ["a"]
+    assert deserialize_field({"M": {"a": {"S": "b"}}}) == {"a": "b"}
+    assert deserialize_field({"BOOL": False}) is False
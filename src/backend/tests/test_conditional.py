@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from fastapi import Response
+from starlette.requests import Request
+
+from savethespice.lib.conditional import get_etag, get_not_modified_response, set_validators
+
+ETAG = get_etag("user", 1)
+
+
+def _get_request(**headers: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [
+                (name.replace("_", "-").lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+        }
+    )
+
+
+def _get_times(age: timedelta) -> tuple[str, str]:
+    """
+    :return: (Modification time `age` ago in ISO format, The same time as an HTTP date)
+    """
+    # Edit times only have second precision
+    modified = (datetime.now(tz=timezone.utc) - age).replace(microsecond=0)
+    return modified.isoformat(), format_datetime(modified, usegmt=True)
+
+
+def test_etag_matches():
+    res = get_not_modified_response(_get_request(If_None_Match=f'"other", {ETAG}'), ETAG)
+
+    assert res.status_code == 304
+    assert res.headers["ETag"] == ETAG
+
+
+def test_etag_differs():
+    assert get_not_modified_response(_get_request(If_None_Match='W/"other"'), ETAG) is None
+
+
+def test_etag_takes_precedence():
+    last_modified, if_modified_since = _get_times(timedelta(minutes=1))
+    req = _get_request(If_None_Match='W/"other"', If_Modified_Since=if_modified_since)
+
+    assert get_not_modified_response(req, ETAG, last_modified) is None
+
+
+def test_modified_in_settled_second():
+    last_modified, if_modified_since = _get_times(timedelta(minutes=1))
+    req = _get_request(If_Modified_Since=if_modified_since)
+
+    res = get_not_modified_response(req, ETAG, last_modified)
+
+    assert res.status_code == 304
+    assert res.headers["Last-Modified"] == if_modified_since
+
+
+def test_modified_in_current_second():
+    last_modified, if_modified_since = _get_times(timedelta())
+    req = _get_request(If_Modified_Since=if_modified_since)
+
+    # Another change could still happen within the same second
+    assert get_not_modified_response(req, ETAG, last_modified) is None
+
+
+def test_modified_since():
+    last_modified, _ = _get_times(timedelta(minutes=1))
+    _, if_modified_since = _get_times(timedelta(minutes=2))
+
+    req = _get_request(If_Modified_Since=if_modified_since)
+
+    assert get_not_modified_response(req, ETAG, last_modified) is None
+
+
+def test_invalid_if_modified_since():
+    last_modified, _ = _get_times(timedelta(minutes=1))
+
+    assert (
+        get_not_modified_response(_get_request(If_Modified_Since="x"), ETAG, last_modified) is None
+    )
+
+
+def test_validators():
+    last_modified, http_date = _get_times(timedelta(minutes=1))
+    res = Response()
+
+    set_validators(res, ETAG, last_modified)
+
+    assert res.headers["ETag"] == ETAG
+    assert res.headers["Last-Modified"] == http_date
+    assert res.headers["Cache-Control"] == "private, no-cache"
+    assert res.headers["Vary"] == "Authorization"
+
+
+def test_validators_leave_out_unsettled_time():
+    last_modified, _ = _get_times(timedelta())
+    res = Response()
+
+    set_validators(res, ETAG, last_modified)
+
+    assert res.headers["ETag"] == ETAG
+    assert "Last-Modified" not in res.headers
@@ -0,0 +1,191 @@
+import json
+from base64 import urlsafe_b64encode
+
+import pytest
+from botocore.exceptions import ClientError
+
+from savethespice.crud import common
+from savethespice.crud.common import (
+    batch_write_to_table,
+    decode_page_token,
+    encode_page_token,
+    transact_write_to_table,
+)
+
+KEY = ("userId", "user")
+KEY_TYPES = {"recipeId": int}
+TABLE = "TestTable"
+
+
+class StubClient:
+    """
+    Client returning each of `responses` in turn, raising those that are errors.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def _respond(self, **request):
+        self.requests.append(request)
+        if isinstance(res := self.responses.pop(0), Exception):
+            raise res
+        return res
+
+    batch_write_item = transact_write_items = _respond
+
+
+def get_client_error(code: str, operation: str, **response) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}, **response}, operation)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(common, "sleep", lambda _: None)
+
+
+def _get_token(last_key) -> str:
+    return urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def test_page_token_round_trip():
+    token = encode_page_token({"userId": "user", "recipeId": 5}, KEY)
+
+    assert decode_page_token(token, KEY, KEY_TYPES) == {"userId": "user", "recipeId": 5}
+
+
+def test_page_token_stays_in_partition():
+    token = _get_token({"recipeId": 5})
+
+    assert decode_page_token(token, ("userId", "other"), KEY_TYPES)["userId"] == "other"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not a token!",
+        urlsafe_b64encode(b"\xff").decode(),
+        _get_token([5]),
+        _get_token({}),
+        # Tampered with
+        _get_token({"userId": "other", "recipeId": 5}),
+        _get_token({"recipeId": 5, "name": "Soup"}),
+        _get_token({"categoryId": 5}),
+        # Wrong types
+        _get_token({"recipeId": 1.5}),
+        _get_token({"recipeId": "5"}),
+        _get_token({"recipeId": [5]}),
+        _get_token({"recipeId": {"N": "5"}}),
+        _get_token({"recipeId": True}),
+        _get_token({"recipeId": None}),
+    ],
+)
+def test_invalid_page_token(token: str):
+    with pytest.raises(AssertionError):
+        decode_page_token(token, KEY, KEY_TYPES)
+
+
+def _get_put_requests(*recipe_ids: int) -> list[dict]:
+    return [{"PutRequest": {"Item": {"userId": "user", "recipeId": i}}} for i in recipe_ids]
+
+
+def test_batch_write_retries_unprocessed_items():
+    unprocessed = {"PutRequest": {"Item": {"userId": {"S": "user"}, "recipeId": {"N": "1"}}}}
+    client = StubClient({"UnprocessedItems": {TABLE: [unprocessed]}}, {})
+
+    assert batch_write_to_table(client, TABLE, requests=_get_put_requests(0, 1)) == []
+    assert client.requests[1]["RequestItems"] == {TABLE: [unprocessed]}
+
+
+def test_batch_write_retries_throttling():
+    client = StubClient(get_client_error("ThrottlingException", "BatchWriteItem"), {})
+
+    assert batch_write_to_table(client, TABLE, requests=_get_put_requests(0)) == []
+    assert len(client.requests) == 2
+
+
+def test_batch_write_fails_after_max_attempts():
+    error = get_client_error("ProvisionedThroughputExceededException", "BatchWriteItem")
+    client = StubClient(*[error] * 3)
+
+    requests = _get_put_requests(0, 1)
+    assert batch_write_to_table(client, TABLE, requests=requests, max_attempts=3) == requests
+
+
+def test_batch_write_raises_errors_retrying_wont_fix():
+    client = StubClient(get_client_error("ValidationException", "BatchWriteItem"), {})
+
+    with pytest.raises(ClientError):
+        batch_write_to_table(client, TABLE, requests=_get_put_requests(0))
+    assert len(client.requests) == 1
+
+
+def _get_transact_items(count: int) -> list[dict]:
+    return [
+        {"Put": {"TableName": TABLE, "Item": {"userId": {"S": "user"}, "recipeId": {"N": str(i)}}}}
+        for i in range(count)
+    ]
+
+
+def _get_cancellation(*reasons: str) -> ClientError:
+    return get_client_error(
+        "TransactionCanceledException",
+        "TransactWriteItems",
+        CancellationReasons=[{"Code": reason} for reason in reasons],
+    )
+
+
+def test_transact_write_retries_conflicts():
+    items = _get_transact_items(2)
+    client = StubClient(_get_cancellation("TransactionConflict", "None"), {})
+
+    assert transact_write_to_table(client, items=items) == (items, [])
+    assert [request["TransactItems"] for request in client.requests] == [items, items]
+
+
+def test_transact_write_leaves_out_failed_condition_checks():
+    items = _get_transact_items(3)
+    client = StubClient(_get_cancellation("None", "ConditionalCheckFailed", "None"), {})
+
+    assert transact_write_to_table(client, items=items) == ([items[0], items[2]], [])
+    assert client.requests[1]["TransactItems"] == [items[0], items[2]]
+
+
+def test_transact_write_with_every_condition_check_failing():
+    client = StubClient(_get_cancellation("ConditionalCheckFailed", "ConditionalCheckFailed"))
+
+    assert transact_write_to_table(client, items=_get_transact_items(2)) == ([], [])
+    assert len(client.requests) == 1
+
+
+def test_transact_write_fails_after_max_attempts():
+    items = _get_transact_items(2)
+    client = StubClient(*[_get_cancellation("ThrottlingError", "None")] * 3)
+
+    assert transact_write_to_table(client, items=items, max_attempts=3) == ([], items)
+    assert len(client.requests) == 3
+
+
+def test_transact_write_retries_every_item_without_reasons():
+    items = _get_transact_items(2)
+    client = StubClient(_get_cancellation(), get_client_error("InternalServerError", ""), {})
+
+    assert transact_write_to_table(client, items=items) == (items, [])
+    assert len(client.requests) == 3
+
+
+@pytest.mark.parametrize(
+    "error, failed",
+    [
+        (_get_cancellation("ValidationError", "None"), [0, 1]),
+        # Only items whose condition check passed
+        (_get_cancellation("ConditionalCheckFailed", "ItemCollectionSizeLimitExceeded"), [1]),
+        (get_client_error("ValidationException", "TransactWriteItems"), [0, 1]),
+    ],
+)
+def test_transact_write_fails_without_retrying_other_errors(error: ClientError, failed: list[int]):
+    items = _get_transact_items(2)
+    client = StubClient(error, {})
+
+    assert transact_write_to_table(client, items=items) == ([], [items[i] for i in failed])
+    assert len(client.requests) == 1
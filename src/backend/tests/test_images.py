@@ -0,0 +1,182 @@
+import os
+from threading import Barrier
+
+import boto3
+from conftest import USER_ID, get_jpeg
+
+from savethespice.crud import image_refs_table
+from savethespice.crud.common import get_client
+from savethespice.lib import images
+from savethespice.lib.images import IMAGE_PREFIX, IMAGE_VARIANTS
+
+
+def _get_stored_keys() -> set[str]:
+    res = boto3.client("s3").list_objects_v2(Bucket=os.environ["images_bucket_name"])
+    return {obj["Key"] for obj in res.get("Contents", [])}
+
+
+def _get_ref_count(image_key: str) -> int:
+    item = get_client().get_item(
+        TableName=os.environ["image_refs_table_name"], Key={"imageKey": {"S": image_key}}
+    )
+    return int(item["Item"]["refCount"]["N"]) if "Item" in item else 0
+
+
+def test_add_image(aws, pages):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+
+    img_src, variants = images.add_image(f"{server}/soup.jpg")
+
+    key = img_src.removeprefix(IMAGE_PREFIX)
+    assert img_src.startswith(IMAGE_PREFIX) and key.endswith(".jpeg")
+    assert set(variants) == set(IMAGE_VARIANTS)
+    assert _get_stored_keys() == {
+        url.removeprefix(IMAGE_PREFIX) for url in [img_src, *variants.values()]
+    }
+    assert _get_ref_count(key) == 1
+
+
+def test_identical_images_are_stored_once(aws, pages):
+    server, responses = pages
+    responses["/soup.jpg"] = responses["/same-soup.jpg"] = (200, "image/jpeg", get_jpeg())
+
+    img_src, variants = images.add_image(f"{server}/soup.jpg")
+    other_img_src, other_variants = images.add_image(f"{server}/same-soup.jpg")
+    hosted_img_src, hosted_variants = images.add_image(img_src)
+
+    assert img_src == other_img_src == hosted_img_src
+    assert variants == other_variants == hosted_variants
+    assert len(_get_stored_keys()) == 1 + len(IMAGE_VARIANTS)
+    assert _get_ref_count(img_src.removeprefix(IMAGE_PREFIX)) == 3
+
+
+def test_released_images_are_deleted_once_unreferenced(aws, pages):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+    responses["/salad.jpg"] = (200, "image/jpeg", get_jpeg(color=(10, 200, 10)))
+    soup_src = images.add_image(f"{server}/soup.jpg")[0]
+    images.add_image(f"{server}/soup.jpg")
+    salad_src = images.add_image(f"{server}/salad.jpg")[0]
+
+    images.release_images(USER_ID, [soup_src, salad_src, None, "http://example.com/a.jpg"])
+
+    salad_key = salad_src.removeprefix(IMAGE_PREFIX)
+    soup_key = soup_src.removeprefix(IMAGE_PREFIX)
+    assert _get_stored_keys() == set(images._get_image_keys(soup_key))
+    assert _get_ref_count(soup_key) == 1
+    assert _get_ref_count(salad_key) == 0
+
+    images.release_images(USER_ID, [soup_src])
+
+    assert _get_stored_keys() == set()
+    assert _get_ref_count(soup_key) == 0
+
+
+def test_images_stored_before_refs_were_counted(aws):
+    key = "legacy.png"
+    boto3.client("s3").put_object(Bucket=os.environ["images_bucket_name"], Key=key, Body=b"x")
+
+    assert images.add_image(f"{IMAGE_PREFIX}{key}") == (f"{IMAGE_PREFIX}{key}", {})
+    # Counted along with the reference it already had
+    assert _get_ref_count(key) == 2
+
+    images.release_images(USER_ID, [f"{IMAGE_PREFIX}{key}"] * 2)
+
+    assert _get_stored_keys() == set()
+
+
+def test_unstored_self_hosted_image(aws):
+    assert images.add_image(f"{IMAGE_PREFIX}missing.png") == (f"{IMAGE_PREFIX}missing.png", {})
+    assert _get_ref_count("missing.png") == 0
+
+
+def test_image_failing_to_download(aws, pages):
+    server, responses = pages
+    responses["/page.jpg"] = (200, "text/html", b"<html>")
+
+    assert images.add_image(f"{server}/page.jpg") == (f"{server}/page.jpg", {})
+    assert images.add_image(f"{server}/missing.jpg") == (f"{server}/missing.jpg", {})
+    assert _get_stored_keys() == set()
+
+
+def test_image_added_while_being_deleted(aws, pages, monkeypatch):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+    img_src = images.add_image(f"{server}/soup.jpg")[0]
+    delete_keys = images._delete_keys
+    added = []
+
+    def _delete_keys(keys: list[str]) -> None:
+        # Released, but still in the bucket
+        added.extend(images.add_image(src) for src in (img_src, f"{server}/soup.jpg"))
+        delete_keys(keys)
+
+    monkeypatch.setattr(images, "_delete_keys", _delete_keys)
+    images.release_images(USER_ID, [img_src])
+
+    # Neither taken for an image stored before references were counted, nor stored again
+    assert added == [(img_src, {}), (f"{server}/soup.jpg", {})]
+    assert _get_stored_keys() == set()
+    assert _get_ref_count(img_src.removeprefix(IMAGE_PREFIX)) == 0
+
+    # Until it's deleted
+    assert images.add_image(f"{server}/soup.jpg")[0] == img_src
+    assert len(_get_stored_keys()) == 1 + len(IMAGE_VARIANTS)
+    assert _get_ref_count(img_src.removeprefix(IMAGE_PREFIX)) == 1
+
+
+def test_image_deleted_while_being_stored(aws, pages, monkeypatch):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+    add_image_variants = images._add_image_variants
+
+    def _add_image_variants(stem: str, file) -> dict[str, str]:
+        # Stored and deleted by another process, possibly after this copy is uploaded
+        key = f"{stem}.jpeg"
+        image_refs_table.create(key, {}, 0)
+        image_refs_table.release(key)
+        image_refs_table.set_deleted(key)
+        return add_image_variants(stem, file)
+
+    monkeypatch.setattr(images, "_add_image_variants", _add_image_variants)
+
+    assert images.add_image(f"{server}/soup.jpg") == (f"{server}/soup.jpg", {})
+
+    monkeypatch.undo()
+    img_src = images.add_image(f"{server}/soup.jpg")[0]
+    assert _get_ref_count(img_src.removeprefix(IMAGE_PREFIX)) == 1
+
+
+def test_identical_images_are_uploaded_once_at_a_time(aws, pages, monkeypatch):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+    upload_image = images._upload_image
+    uploads = []
+    monkeypatch.setattr(
+        images, "_upload_image", lambda *args: uploads.append(args) or upload_image(*args)
+    )
+
+    results = images.add_images([f"{server}/soup.jpg"] * 4)
+
+    assert len(uploads) == 1
+    assert len({img_src for img_src, _ in results}) == 1
+    assert _get_ref_count(results[0][0].removeprefix(IMAGE_PREFIX)) == 4
+
+
+def test_different_images_are_stored_in_parallel(aws, pages, monkeypatch):
+    server, responses = pages
+    responses["/soup.jpg"] = (200, "image/jpeg", get_jpeg())
+    responses["/salad.jpg"] = (200, "image/jpeg", get_jpeg(color=(10, 200, 10)))
+    add_image_variants = images._add_image_variants
+    both_storing = Barrier(2, timeout=5)
+
+    def _add_image_variants(stem: str, file) -> dict[str, str]:
+        both_storing.wait()
+        return add_image_variants(stem, file)
+
+    monkeypatch.setattr(images, "_add_image_variants", _add_image_variants)
+
+    results = images.add_images([f"{server}/soup.jpg", f"{server}/salad.jpg"])
+
+    assert all(img_src.startswith(IMAGE_PREFIX) for img_src, _ in results)
@@ -0,0 +1,18 @@
+"""
+Check that each Lambda entry point leaves the dependencies in `benchmarks/import_budget.json` to the
+routes and functions using them, rather than importing them at cold start.
+"""
+import json
+
+import pytest
+from benchmarks.import_time import BUDGET_PATH, measure
+
+BUDGET = json.loads(BUDGET_PATH.read_text())
+
+
+@pytest.mark.parametrize("entry", BUDGET["entries"])
+def test_deferred_imports(entry: str):
+    _, imported = measure(entry, repeats=1)
+
+    deferred = BUDGET["deferred"] + BUDGET["entries"][entry].get("deferred", [])
+    assert not imported.intersection(deferred)
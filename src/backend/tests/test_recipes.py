@@ -0,0 +1,91 @@
+import json
+import os
+from base64 import urlsafe_b64encode
+
+import pytest
+from conftest import USER_ID
+from fastapi.testclient import TestClient
+
+from savethespice.crud import meta_table
+from savethespice.crud.common import get_client, get_item_from_table
+
+NDJSON = {"Accept": "application/x-ndjson"}
+USER_KEY = {"userId": USER_ID}
+
+
+def _get_token(last_key) -> str:
+    return urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def _add_recipes(client: TestClient, count: int) -> None:
+    res = client.put("/private/recipes", json=[{"name": f"Recipe {i}"} for i in range(count)])
+    assert res.status_code == 200, res.text
+
+
+def test_pages_cover_every_recipe_once(client: TestClient):
+    _add_recipes(client, 7)
+
+    recipe_ids, params = [], {"limit": 3}
+    while True:
+        res = client.get("/private/recipes", params=params)
+        assert res.status_code == 200, res.text
+        data = res.json()["data"]
+        assert len(data["recipes"]) <= 3
+        recipe_ids += [recipe["recipeId"] for recipe in data["recipes"]]
+        if not data["nextToken"]:
+            break
+        params = {"limit": 3, "nextToken": data["nextToken"]}
+
+    assert recipe_ids == list(range(7))
+
+
+def test_last_page_has_no_next_token(client: TestClient):
+    _add_recipes(client, 2)
+
+    res = client.get("/private/recipes", params={"limit": 5})
+
+    assert len(res.json()["data"]["recipes"]) == 2
+    assert res.json()["data"]["nextToken"] is None
+
+
+@pytest.mark.parametrize(
+    "next_token", ["not a token!", _get_token({"recipeId": 1.5}), _get_token({"name": "Soup"})]
+)
+def test_invalid_next_token(client: TestClient, next_token: str):
+    _add_recipes(client, 2)
+
+    res = client.get("/private/recipes", params={"nextToken": next_token})
+
+    assert res.status_code == 400
+
+
+def test_stream(client: TestClient):
+    _add_recipes(client, 3)
+
+    res = client.get("/private/recipes", headers=NDJSON)
+
+    assert res.headers["Content-Type"].startswith("application/x-ndjson")
+    assert len(res.text.splitlines()) == 3
+
+
+def test_stream_rejects_pages(client: TestClient):
+    _add_recipes(client, 3)
+
+    for params in ({"limit": 1}, {"nextToken": "e30="}):
+        res = client.get("/private/recipes", params=params, headers=NDJSON)
+
+        assert res.status_code == 400
+        assert "message" in res.json()
+
+
+def test_reads_leave_last_modified_marker_to_writes(client: TestClient):
+    etag = client.get("/private/recipes").headers["ETag"]
+
+    assert get_item_from_table(get_client(), os.environ["meta_table_name"], key=USER_KEY) == {}
+    assert meta_table.get_last_modified(USER_ID, "recipes") == (0, "1970-01-01T00:00:00+00:00")
+    assert client.get("/private/recipes", headers={"If-None-Match": etag}).status_code == 304
+
+    _add_recipes(client, 1)
+
+    assert client.get("/private/recipes", headers={"If-None-Match": etag}).status_code == 200
+    assert meta_table.get_last_modified(USER_ID, "recipes")[0] == 1
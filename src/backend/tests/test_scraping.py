@@ -0,0 +1,108 @@
+import json
+
+import pytest
+from requests.exceptions import HTTPError
+
+from savethespice.crud import scrape_cache_table
+from savethespice.lib import scraping
+from savethespice.lib.scraping import normalize_url
+
+RECIPE = {
+    "@context": "https://schema.org",
+    "@type": "Recipe",
+    "name": "Soup",
+    "totalTime": "PT10M",
+    "recipeYield": "2",
+    "image": "http://example.com/soup.jpg",
+    "recipeIngredient": ["Water"],
+    "recipeInstructions": "1. Boil\n2. Serve",
+}
+PAGE = f'<html><script type="application/ld+json">{json.dumps(RECIPE)}</script></html>'.encode()
+
+
+@pytest.mark.parametrize(
+    "url, normalized",
+    [
+        ("Example.com/Recipe/", "http://example.com/Recipe"),
+        ("https://example.com:443/recipe#step-2", "https://example.com/recipe"),
+        ("http://example.com:8080/recipe", "http://example.com:8080/recipe"),
+        ("http://example.com/recipe?b=2&a=1", "http://example.com/recipe?a=1&b=2"),
+        (
+            "http://example.com/recipe?utm_source=x&UTM_medium=y&id=1",
+            "http://example.com/recipe?id=1",
+        ),
+        ("  http://example.com/recipe?empty=  ", "http://example.com/recipe?empty="),
+    ],
+)
+def test_normalize_url(url: str, normalized: str):
+    assert normalize_url(url) == normalized
+
+
+def test_scrape(aws, pages):
+    server, responses = pages
+    responses["/soup"] = (200, "text/html", PAGE)
+
+    data = scraping.scrape(f"{server}/soup")
+
+    assert data["name"] == "Soup"
+    assert data["instructions"] == ["Boil", "Serve"]
+    assert data["url"] == f"{server}/soup"
+
+
+def test_scrape_reuses_variations_of_url(aws, pages):
+    server, responses = pages
+    responses["/soup?a=1&b=2"] = (200, "text/html", PAGE)
+    scraping.scrape(f"{server}/soup?a=1&b=2")
+    del responses["/soup?a=1&b=2"]
+
+    data = scraping.scrape(f"{server}/soup/?b=2&a=1#ingredients")
+
+    assert data["name"] == "Soup"
+    # Each request gets back the URL it asked for
+    assert data["url"] == f"{server}/soup/?b=2&a=1#ingredients"
+
+
+def test_scrape_falls_back_to_shared_cache(aws, pages):
+    server, responses = pages
+    responses["/soup"] = (200, "text/html", PAGE)
+    scraping.scrape(f"{server}/soup")
+    del responses["/soup"]
+    # As in another process
+    scraping._cache._entries.clear()
+
+    assert scraping.scrape(f"{server}/soup")["name"] == "Soup"
+    # And cached in process again
+    assert scraping._cache.get(normalize_url(f"{server}/soup"))["name"] == "Soup"
+
+
+def test_scrape_ignores_expired_shared_cache(aws, pages):
+    server, responses = pages
+    key = normalize_url(f"{server}/soup")
+    scrape_cache_table.put(key, {"name": "Stale"}, ttl=0)
+    responses["/soup"] = (200, "text/html", PAGE)
+
+    assert scraping.scrape(f"{server}/soup")["name"] == "Soup"
+
+
+@pytest.mark.parametrize("status", [404, 500])
+def test_error_pages_are_not_scraped_or_cached(aws, pages, status: int):
+    server, responses = pages
+    responses["/soup"] = (status, "text/html", PAGE)
+
+    with pytest.raises(HTTPError):
+        scraping.scrape(f"{server}/soup")
+    assert scraping._cache.get(normalize_url(f"{server}/soup")) is None
+    assert scrape_cache_table.get(normalize_url(f"{server}/soup")) is None
+
+    responses["/soup"] = (200, "text/html", PAGE)
+    assert scraping.scrape(f"{server}/soup")["name"] == "Soup"
+
+
+def test_scrape_route_reports_error_pages(client, pages):
+    server, responses = pages
+    responses["/soup"] = (503, "text/html", b"Unavailable")
+
+    res = client.get("/private/scrape", params={"url": f"{server}/soup"})
+
+    assert res.status_code == 502
+    assert "503" in res.json()["message"]
@@ -135,7 +135,7 @@ export const RecipeList: FC = () => {
               <Image
                 width={120}
                 height={80}
-                src={recipe.imgSrc}
+                src={recipe.imgVariants?.thumbnail ?? recipe.imgSrc}
                 sx={{ position: "relative" }}
                 styles={{ placeholder: { width: 120 } }}
                 withPlaceholder
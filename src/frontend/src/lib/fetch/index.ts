@@ -25,6 +25,7 @@ export type { GetRecipesResponse } from "./types/GetRecipesResponse";
 export type { GetRecipesResponseData } from "./types/GetRecipesResponseData";
 export type { GetRecipeWithShareIdResponse } from "./types/GetRecipeWithShareIdResponse";
 export type { HTTPValidationError } from "./types/HTTPValidationError";
+export type { PartialRecipe } from "./types/PartialRecipe";
 export type { PatchCategoriesResponse } from "./types/PatchCategoriesResponse";
 export type { PatchCategoriesResponseData } from "./types/PatchCategoriesResponseData";
 export type { PatchCategoryRequest } from "./types/PatchCategoryRequest";
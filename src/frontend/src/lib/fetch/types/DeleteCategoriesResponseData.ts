@@ -3,4 +3,5 @@
 export type DeleteCategoriesResponseData = {
   updatedRecipes?: number[];
   failedDeletions?: number[];
+  failedRecipeUpdates?: number[];
 };
@@ -2,4 +2,5 @@
 
 export type DeleteCategoryResponseData = {
   updatedRecipes?: number[];
+  failedRecipeUpdates?: number[];
 };
@@ -3,5 +3,6 @@
 import type { GetRecipesResponseData } from "./GetRecipesResponseData";
 
 export type GetRecipesResponse = {
+  message?: string;
   data: GetRecipesResponseData;
 };
@@ -1,7 +1,11 @@
 /* eslint-disable */
 
+import type { PartialRecipe } from "./PartialRecipe";
 import type { Recipe } from "./Recipe";
 
 export type GetRecipesResponseData = {
-  recipes: Recipe[];
+  recipes: (Recipe | PartialRecipe)[];
+  nextToken?: string;
+  deletedIds?: number[];
+  syncTime?: string;
 };
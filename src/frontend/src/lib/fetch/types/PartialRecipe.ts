@@ -0,0 +1,18 @@
+/* eslint-disable */
+
+export type PartialRecipe = {
+  name?: string;
+  desc?: string;
+  cookTime?: string;
+  yields?: string;
+  ingredients?: string[];
+  instructions?: string[];
+  categories?: number[];
+  adaptedFrom?: string;
+  url?: string;
+  imgSrc?: string;
+  imgVariants?: Record<string, string>;
+  createTime?: string;
+  updateTime?: string;
+  recipeId: number;
+};
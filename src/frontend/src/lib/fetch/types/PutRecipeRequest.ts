@@ -11,4 +11,5 @@ export type PutRecipeRequest = {
   adaptedFrom?: string;
   url?: string;
   imgSrc?: string;
+  imgVariants?: Record<string, string>;
 };
@@ -11,6 +11,7 @@ export type Recipe = {
   adaptedFrom?: string;
   url?: string;
   imgSrc?: string;
+  imgVariants?: Record<string, string>;
   createTime: string;
   updateTime: string;
   recipeId: number;
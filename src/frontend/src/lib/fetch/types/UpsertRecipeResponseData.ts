@@ -13,6 +13,7 @@ export type UpsertRecipeResponseData = {
   adaptedFrom?: string;
   url?: string;
   imgSrc?: string;
+  imgVariants?: Record<string, string>;
   createTime: string;
   updateTime: string;
   recipeId: number;